@@ -0,0 +1,411 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+import storage
+
+# =====================================================
+# Буфер записи аналитики (write-behind).
+# /api/analytics только кладёт событие в память и сразу отвечает.
+# Фоновый поток раз в FLUSH_INTERVAL_MS (или как только набралось FLUSH_EVENTS)
+# пишет всё накопленное одной транзакцией: события — executemany в analytics,
+# профили — один UPSERT на пользователя с уже сложенными счётчиками,
+# роллапы — счётчики действий по (bucket, action, platform) за минуту/час/день.
+# =====================================================
+
+FLUSH_INTERVAL_MS = int(os.getenv("ANALYTICS_FLUSH_MS", "1000"))
+FLUSH_EVENTS = int(os.getenv("ANALYTICS_FLUSH_EVENTS", "500"))
+# Если БД недоступна дольше обычного — держим в памяти не больше стольких событий
+MAX_PENDING = int(os.getenv("ANALYTICS_MAX_PENDING", "100000"))
+
+# Роллапы: таблица и длина префикса ISO-времени UTC «YYYY-MM-DDTHH:MM», задающего bucket
+ROLLUPS = {
+    "minute": ("analytics_rollup_minute", 16),
+    "hour": ("analytics_rollup_hour", 13),
+    "day": ("analytics_rollup_day", 10),
+}
+# Поминутные счётчики нужны только для «живого» графика — старше храним по часам/дням
+MINUTE_RETENTION_HOURS = int(os.getenv("ANALYTICS_MINUTE_RETENTION_HOURS", "48"))
+
+# Ошибки, которые повтор того же сброса не исправит (битое событие, нарушение ограничения):
+# такой сброс не возвращаем в буфер, а дописываем построчно, пропуская битые строки.
+# Ошибка привязки параметра — InterfaceError в 3.11, ProgrammingError в 3.12+.
+NON_TRANSIENT_ERRORS = (sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError)
+
+_INSERT_EVENT = "INSERT INTO analytics (user_id, action, details, timestamp) VALUES (?, ?, ?, ?)"
+_UPSERT_PROFILE = """
+    INSERT INTO user_profiles (user_id, first_name, username, last_seen, platform, total_actions, first_seen, last_action)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        last_seen = excluded.last_seen,
+        platform = excluded.platform,
+        total_actions = total_actions + excluded.total_actions,
+        last_action = excluded.last_action
+"""
+_UPSERT_ROLLUP = """
+    INSERT INTO {table} (bucket, action, platform, count) VALUES (?, ?, ?, ?)
+    ON CONFLICT(bucket, action, platform) DO UPDATE SET count = count + excluded.count
+"""
+
+
+def event_error(event) -> str | None:
+    """
+    Проверка события из запроса {user_id, action?, details?, timestamp?}.
+    None — событие можно класть в буфер, иначе — описание ошибки для ответа 400.
+    """
+    if not isinstance(event, dict):
+        return "событие должно быть объектом"
+    user_id = event.get("user_id")
+    if user_id is not None and (isinstance(user_id, bool) or not isinstance(user_id, (str, int))):
+        return "user_id: ожидается строка или число"
+    if not isinstance(event.get("action", ""), (str, type(None))):
+        return "action: ожидается строка"
+    details = event.get("details")
+    if details is not None and not isinstance(details, dict):
+        return "details: ожидается объект"
+    if details and not isinstance(details.get("platform", ""), (str, type(None))):
+        return "details.platform: ожидается строка"
+    if not isinstance(event.get("timestamp", ""), (str, type(None))):
+        return "timestamp: ожидается строка"
+    return None
+
+
+def init_analytics_schema(conn):
+    """Таблицы analytics.db: события, ошибки клиента, профили пользователей и роллапы."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS analytics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            action TEXT,
+            details TEXT,
+            timestamp TEXT
+        )""")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS errors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            error TEXT,
+            details TEXT,
+            timestamp TEXT
+        )""")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            user_id TEXT PRIMARY KEY,
+            first_name TEXT,
+            username TEXT,
+            last_seen TEXT,
+            platform TEXT,
+            total_actions INTEGER DEFAULT 0,
+            first_seen TEXT,
+            last_action TEXT
+        )""")
+    # «Онлайн» и список пользователей дашборда — по last_seen
+    conn.execute("CREATE INDEX IF NOT EXISTS user_profiles_last_seen_idx ON user_profiles(last_seen)")
+
+    # Счётчики действий по минутам/часам/дням (их пишет AnalyticsBuffer)
+    init_rollups(conn)
+
+
+def init_rollups(conn):
+    """
+    Таблицы роллапов и счётчик ошибок. При первом создании засеваем их
+    по уже накопленной истории (один проход по analytics, bucket — по timestamp события).
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (ROLLUPS["day"][0],)
+    ).fetchone()
+    for table, _ in ROLLUPS.values():
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket   TEXT NOT NULL,     -- UTC: 2025-01-31T12:34 / 2025-01-31T12 / 2025-01-31
+                action   TEXT NOT NULL,
+                platform TEXT NOT NULL,
+                count    INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, action, platform)
+            ) WITHOUT ROWID
+        """)
+    # errors пишется в обход буфера — его размер ведут триггеры
+    conn.execute("CREATE TABLE IF NOT EXISTS analytics_counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS errors_count_insert AFTER INSERT ON errors BEGIN
+            INSERT INTO analytics_counters (name, value) VALUES ('errors', 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS errors_count_delete AFTER DELETE ON errors BEGIN
+            UPDATE analytics_counters SET value = value - 1 WHERE name = 'errors';
+        END
+    """)
+    if exists:
+        return
+
+    minute_table, minute_len = ROLLUPS["minute"]
+    conn.execute(f"""
+        INSERT INTO {minute_table} (bucket, action, platform, count)
+        SELECT COALESCE(substr(timestamp, 1, {minute_len}), ''),
+               CASE WHEN typeof(action) = 'text' THEN action ELSE 'unknown' END,
+               CASE WHEN json_valid(details) AND json_type(details, '$.platform') = 'text'
+                    THEN json_extract(details, '$.platform') ELSE 'unknown' END,
+               COUNT(*)
+        FROM analytics
+        GROUP BY 1, 2, 3
+    """)
+    for name in ("hour", "day"):
+        table, length = ROLLUPS[name]
+        conn.execute(f"""
+            INSERT INTO {table} (bucket, action, platform, count)
+            SELECT substr(bucket, 1, {length}), action, platform, SUM(count)
+            FROM {minute_table}
+            GROUP BY 1, 2, 3
+        """)
+    conn.execute(f"DELETE FROM {minute_table} WHERE bucket < ?", (_minute_cutoff(),))
+    conn.execute(
+        "INSERT OR REPLACE INTO analytics_counters (name, value) SELECT 'errors', COUNT(*) FROM errors"
+    )
+
+
+def _minute_cutoff() -> str:
+    cutoff = datetime.now(timezone.utc).timestamp() - MINUTE_RETENTION_HOURS * 3600
+    return datetime.fromtimestamp(cutoff, timezone.utc).strftime("%Y-%m-%dT%H:%M")
+
+
+def _accumulate(profiles: dict, rollup: dict, event: tuple, first_seen: str):
+    """Учесть событие в профиле его пользователя и в минутном роллапе."""
+    user_id, action, _, timestamp, platform, minute = event
+    profile = profiles.get(user_id)
+    if profile is None:
+        profile = profiles[user_id] = {"count": 0, "first_seen": first_seen}
+    profile["count"] += 1
+    profile["last_seen"] = timestamp
+    profile["platform"] = platform
+    profile["last_action"] = action
+    key = (minute, action, platform)
+    rollup[key] = rollup.get(key, 0) + 1
+
+
+def _profile_rows(profiles: dict, names: dict) -> list[tuple]:
+    return [
+        (user_id, names.get(user_id, {}).get("first_name", ""), names.get(user_id, {}).get("username", ""),
+         p["last_seen"], p["platform"], p["count"], p["first_seen"], p["last_action"])
+        for user_id, p in profiles.items()
+    ]
+
+
+def _rollup_rows(rollup: dict):
+    """(таблица, строки UPSERT) для каждого роллапа: минутные счётчики, сложенные до его bucket."""
+    for table, length in ROLLUPS.values():
+        counts: dict[tuple, int] = {}
+        for (minute, action, platform), n in rollup.items():
+            key = (minute[:length], action, platform)
+            counts[key] = counts.get(key, 0) + n
+        yield table, [(*key, n) for key, n in counts.items()]
+
+
+def _execute_row(conn, sql: str, row: tuple) -> bool:
+    """Одна строка в своём SAVEPOINT: при неисправимой ошибке откатываем только её."""
+    conn.execute("SAVEPOINT analytics_row")
+    try:
+        conn.execute(sql, row)
+    except NON_TRANSIENT_ERRORS as e:
+        conn.execute("ROLLBACK TO analytics_row")
+        conn.execute("RELEASE analytics_row")
+        print(f"❌ Analytics row dropped: {e}")
+        return False
+    conn.execute("RELEASE analytics_row")
+    return True
+
+
+class AnalyticsBuffer:
+    """
+    События аналитики в памяти + поток, сбрасывающий их в analytics.db.
+    profile_lookup(user_ids) -> {user_id: {"first_name", "username"}} — имена для новых профилей,
+    вызывается один раз на сброс.
+    """
+
+    def __init__(self, path, profile_lookup=None, flush_interval_ms: int = FLUSH_INTERVAL_MS,
+                 flush_events: int = FLUSH_EVENTS, max_pending: int = MAX_PENDING):
+        self.path = path
+        self.profile_lookup = profile_lookup
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_events = flush_events
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # сброс по таймеру и на остановке не должны пересечься
+        self._events: list[tuple] = []  # (user_id, action, details, timestamp, platform, минута UTC)
+        self._profiles: dict[str, dict] = {}
+        self._rollup: dict[tuple, int] = {}  # (минута UTC, action, platform) -> событий
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+        # счётчики для /api/metrics
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def add(self, user_id, action: str, details, timestamp) -> bool:
+        """Положить событие в буфер (без обращения к БД). False — буфер переполнен, событие отброшено."""
+        # Одно кривое значение не должно ронять сброс всей пачки: всё, что не строка, — "unknown"/None
+        user_id = str(user_id)
+        action = action if isinstance(action, str) else "unknown"
+        details = details if isinstance(details, dict) else {}
+        timestamp = timestamp if isinstance(timestamp, str) else None
+        platform = details.get("platform")
+        platform = platform if isinstance(platform, str) else "unknown"
+        # Роллап — по времени получения на сервере: часам клиента верить нельзя
+        minute = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M")
+        event = (user_id, action, json.dumps(details, ensure_ascii=False, default=str) if details else "{}",
+                 timestamp, platform, minute)
+        # first_seen — время первого события пользователя в этом сбросе (как раньше, по часам сервера)
+        first_seen = datetime.now().isoformat()
+        with self._lock:
+            self.received += 1
+            if len(self._events) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._events.append(event)
+            _accumulate(self._profiles, self._rollup, event, first_seen)
+            full = len(self._events) >= self.flush_events
+        if full:
+            self._wake.set()
+        return True
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._events)
+
+    def flush(self) -> int:
+        """Записать накопленное одной транзакцией. Возвращает число записанных событий."""
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+                profiles, self._profiles = self._profiles, {}
+                rollup, self._rollup = self._rollup, {}
+            if not events:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                names = self.profile_lookup(list(profiles)) if self.profile_lookup else {}
+            except Exception as e:
+                # Имена — только для новых профилей; из-за builds.db аналитику не теряем
+                print(f"❌ Analytics profile lookup error: {e}")
+                names = {}
+
+            written = len(events)
+            try:
+                storage.write(self.path, self._write, events, profiles, rollup, names)
+            except NON_TRANSIENT_ERRORS as e:
+                print(f"❌ Analytics flush error ({len(events)} events), writing row by row: {e}")
+                try:
+                    written = storage.write(self.path, self._write_each, events, profiles, rollup, names)
+                except Exception as e:
+                    print(f"❌ Analytics flush error ({len(events)} events): {e}")
+                    self._requeue(events, profiles, rollup)
+                    return 0
+            except Exception as e:
+                print(f"❌ Analytics flush error ({len(events)} events): {e}")
+                self._requeue(events, profiles, rollup)
+                return 0
+
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.flushes += 1
+                self.written += written
+                self.dropped += len(events) - written
+                self.flush_seconds += elapsed
+                self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            return written
+
+    def _write(self, events: list, profiles: dict, rollup: dict, names: dict):
+        with storage.connection(self.path) as conn:
+            conn.executemany(_INSERT_EVENT, (event[:4] for event in events))
+            conn.executemany(_UPSERT_PROFILE, _profile_rows(profiles, names))
+            for table, rows in _rollup_rows(rollup):
+                conn.executemany(_UPSERT_ROLLUP.format(table=table), rows)
+            conn.execute(f"DELETE FROM {ROLLUPS['minute'][0]} WHERE bucket < ?", (_minute_cutoff(),))
+
+    def _write_each(self, events: list, profiles: dict, rollup: dict, names: dict) -> int:
+        """
+        Запасной путь после неисправимой ошибки пачки: каждая строка в своём SAVEPOINT,
+        битые пропускаются. Профили и роллапы пересчитываются только по реально
+        записанным событиям. Возвращает их число.
+        """
+        written_profiles, written_rollup = {}, {}
+        with storage.connection(self.path) as conn:
+            for event in events:
+                if _execute_row(conn, _INSERT_EVENT, event[:4]):
+                    _accumulate(written_profiles, written_rollup, event, profiles[event[0]]["first_seen"])
+            for row in _profile_rows(written_profiles, names):
+                _execute_row(conn, _UPSERT_PROFILE, row)
+            for table, rows in _rollup_rows(written_rollup):
+                for row in rows:
+                    _execute_row(conn, _UPSERT_ROLLUP.format(table=table), row)
+            conn.execute(f"DELETE FROM {ROLLUPS['minute'][0]} WHERE bucket < ?", (_minute_cutoff(),))
+        return sum(p["count"] for p in written_profiles.values())
+
+    def _requeue(self, events: list, profiles: dict, rollup: dict):
+        """Вернуть несостоявшийся сброс в начало буфера (сверх max_pending — отбросить старые)."""
+        with self._lock:
+            self.failed_flushes += 1
+            merged = events + self._events
+            overflow = max(0, len(merged) - self.max_pending)
+            self.dropped += overflow
+            self._events = merged[overflow:]
+            for user_id, old in profiles.items():
+                current = self._profiles.get(user_id)
+                if current is None:
+                    self._profiles[user_id] = old
+                else:
+                    # Новые события новее: last_* берём из них, счётчик складываем
+                    current["count"] += old["count"]
+                    current["first_seen"] = old["first_seen"]
+            # Отброшенные при переполнении события остаются в роллапах: счётчики важнее строк.
+            # Ключ, который не ляжет в NOT NULL-колонки, не возвращаем — он валил бы каждый сброс
+            for key, n in rollup.items():
+                if all(isinstance(part, str) for part in key):
+                    self._rollup[key] = self._rollup.get(key, 0) + n
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="analytics-flush", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Остановить поток и дописать всё, что осталось в буфере."""
+        if self._thread is not None:
+            self._stopping = True
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": len(self._events),
+                "pending_users": len(self._profiles),
+                "received": self.received,
+                "written": self.written,
+                "dropped": self.dropped,
+                "flushes": self.flushes,
+                "failed_flushes": self.failed_flushes,
+                "avg_flush_ms": round(self.flush_seconds / self.flushes * 1000, 3) if self.flushes else 0.0,
+                "max_flush_ms": round(self.max_flush_seconds * 1000, 3),
+            }
@@ -0,0 +1,98 @@
+"""
+Приём аналитики: событие на запрос против пачек /api/analytics/batch.
+
+    python bench/bench_analytics_ingest.py [events]
+
+Серверная часть без HTTP: разбор JSON-тела запроса + запись.
+  - single, direct   — как было: INSERT + UPSERT профиля + COMMIT на каждое событие;
+  - single, buffered — /api/analytics сейчас: событие в AnalyticsBuffer, сброс пачкой;
+  - batch N          — /api/analytics/batch: одно тело на N событий, тот же буфер.
+Сброс буфера входит в замер. Работает на временных файлах БД.
+"""
+import json
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import storage  # noqa: E402
+from analytics_buffer import AnalyticsBuffer, init_analytics_schema  # noqa: E402
+
+ACTIONS = ("click_button", "open_screen", "view_build", "search", "switch_category")
+BATCH_SIZES = (20, 100)
+
+
+def make_events(n: int) -> list[dict]:
+    rnd = random.Random(n)
+    return [{
+        "user_id": 100000 + rnd.randint(0, 300),
+        "action": rnd.choice(ACTIONS),
+        "details": {"button": f"btn{rnd.randint(0, 30)}", "platform": "ios"},
+        "timestamp": f"2025-01-01T12:{i // 60 % 60:02d}:{i % 60:02d}",
+    } for i in range(n)]
+
+
+def new_db(tmp: Path, name: str) -> Path:
+    path = tmp / f"{name}.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("PRAGMA journal_mode = WAL")
+        init_analytics_schema(conn)
+    return path
+
+
+def single_direct(path: Path, bodies: list[bytes]):
+    for body in bodies:
+        e = json.loads(body)
+        with storage.connection(path) as conn:
+            conn.execute("INSERT INTO analytics (user_id, action, details, timestamp) VALUES (?, ?, ?, ?)",
+                         (str(e["user_id"]), e["action"], json.dumps(e["details"], ensure_ascii=False), e["timestamp"]))
+            conn.execute("""
+                INSERT INTO user_profiles (user_id, first_name, username, last_seen, platform, total_actions, first_seen, last_action)
+                VALUES (?, '', '', ?, ?, 1, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    last_seen = excluded.last_seen, platform = excluded.platform,
+                    total_actions = total_actions + 1, last_action = excluded.last_action
+            """, (str(e["user_id"]), e["timestamp"], e["details"]["platform"], e["timestamp"], e["action"]))
+
+
+def buffered(path: Path, bodies: list[bytes]):
+    buffer = AnalyticsBuffer(path)
+    buffer.start()
+    for body in bodies:
+        data = json.loads(body)
+        for e in data.get("events", [data]):
+            buffer.add(e["user_id"], e["action"], e["details"], e["timestamp"])
+    buffer.stop()
+
+
+def main(n: int):
+    tmp = Path(tempfile.mkdtemp())
+    events = make_events(n)
+    single = [json.dumps(e).encode() for e in events]
+    runs = [("single, direct", single_direct, single), ("single, buffered", buffered, single)]
+    for size in BATCH_SIZES:
+        bodies = [json.dumps({"events": events[i:i + size]}).encode() for i in range(0, n, size)]
+        runs.append((f"batch {size}", buffered, bodies))
+
+    print(f"{n:,} events from {len({e['user_id'] for e in events})} users")
+    baseline = None
+    for name, run, bodies in runs:
+        path = new_db(tmp, name.replace(" ", "_").replace(",", ""))
+        started = time.perf_counter()
+        run(path, bodies)
+        elapsed = time.perf_counter() - started
+        with sqlite3.connect(path) as conn:
+            stored = conn.execute("SELECT COUNT(*) FROM analytics").fetchone()[0]
+            actions = conn.execute("SELECT SUM(total_actions) FROM user_profiles").fetchone()[0]
+        assert stored == actions == n, (name, stored, actions)
+        rate = n / elapsed
+        baseline = baseline or rate
+        print(f"{name:>17}: {len(bodies):>7,} requests | {rate:>10,.0f} events/s (x{rate / baseline:6.1f})")
+    storage.close_all()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if sys.argv[1:] else 20000)
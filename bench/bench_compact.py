@@ -0,0 +1,64 @@
+"""
+Размер ответа /api/builds: обычный JSON против format=compact (id модулей вместо en-названий).
+
+    python bench/bench_compact.py [builds ...]
+
+Работает на временной БД: словарь модулей — из data/modules-*.json, сборки синтетические
+(по 3 вкладки из 5–8 реальных модулей своего типа). Реальные базы не трогает.
+"""
+import gzip
+import json
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import database  # noqa: E402
+
+database.DB_PATH = Path(tempfile.mktemp(suffix=".db"))
+from import_modules import load_modules_seed  # noqa: E402
+
+
+def dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def seed_builds(n: int, seed: dict):
+    rnd = random.Random(n)
+    types = sorted(seed)
+    for i in range(n):
+        weapon_type = types[i % len(types)]
+        names = [m["en"] if isinstance(m, dict) else m for mods in seed[weapon_type].values() for m in mods]
+        tabs = [{"label": f"Вкладка {t}", "items": rnd.sample(names, min(len(names), rnd.randint(5, 8)))}
+                for t in range(3)]
+        database.add_build({
+            "title": f"Build {i}", "weapon_type": weapon_type, "top1": tabs[0]["items"][0] if i % 3 == 0 else "",
+            "date": "01.01.2025", "tabs": tabs, "categories": ["all"],
+        })
+
+
+def main(sizes):
+    database.init_db()
+    seed = load_modules_seed()
+    database.modules_sync(seed)
+    _, snapshot = database.modules_snapshot()
+    dictionary = dumps({"revision": 0, "types": snapshot})
+    print(f"dictionary (/api/modules/all, once per revision): {len(dictionary):,} B, "
+          f"gzip {len(gzip.compress(dictionary)):,} B")
+
+    done = 0
+    for n in sizes:
+        seed_builds(n - done, seed)
+        done = n
+        _, builds, _ = database.get_builds_cached()
+        plain = dumps(builds)
+        compact = dumps({"modules_revision": 0, "builds": database.compact_builds(builds), "next": None})
+        gz_plain, gz_compact = len(gzip.compress(plain)), len(gzip.compress(compact))
+        print(f"{n:>6} builds | json {len(plain):>10,} B  gzip {gz_plain:>9,} B | "
+              f"compact {len(compact):>10,} B  gzip {gz_compact:>9,} B | "
+              f"saved {1 - len(compact) / len(plain):5.1%} raw, {1 - gz_compact / gz_plain:5.1%} gzip")
+
+
+if __name__ == "__main__":
+    main(sorted(int(a) for a in sys.argv[1:]) or [100, 500, 2000])
@@ -0,0 +1,109 @@
+"""
+Профили соединений SQLite: как было (connect на каждый вызов, только WAL) против пула
+с базовыми PRAGMA и пула с профилем tuned (synchronous=NORMAL, cache_size, mmap, кэш запросов).
+
+    python bench/bench_sqlite_profile.py [builds]
+
+Работает на временных файлах БД со схемой builds; реальные базы не трогает.
+"""
+import json
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import storage  # noqa: E402
+
+READS = 3000
+WRITES = 1000
+
+SCHEMA = """
+CREATE TABLE builds (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL, weapon_type TEXT NOT NULL, top1 TEXT, top2 TEXT, top3 TEXT,
+    date TEXT, tabs TEXT NOT NULL, categories TEXT, created_at TEXT
+);
+CREATE INDEX idx_builds_type ON builds(weapon_type, id);
+"""
+
+
+class PerCallConnect:
+    """Старое поведение: новое соединение и PRAGMA на каждый with."""
+
+    def __init__(self, path):
+        self.path = path
+
+    @contextmanager
+    def connection(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode = WAL")
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def close(self):
+        pass
+
+
+def fill(path: Path, n: int):
+    rnd = random.Random(n)
+    tabs = json.dumps([{"label": f"Вкладка {t}", "items": [f"Module {rnd.randint(1, 400)}" for _ in range(8)]}
+                       for t in range(3)], ensure_ascii=False)
+    with sqlite3.connect(path) as conn:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.executescript(SCHEMA)
+        conn.executemany(
+            "INSERT INTO builds (title, weapon_type, top1, date, tabs, categories, created_at) "
+            "VALUES (?, ?, '', '01.01.2025', ?, '[\"all\"]', '2025-01-01')",
+            ((f"Build {i}", f"type{i % 8}", tabs) for i in range(n)),
+        )
+
+
+def run(source, n: int) -> tuple[float, float]:
+    rnd = random.Random(0)
+    started = time.perf_counter()
+    for _ in range(READS):
+        with source.connection() as conn:
+            if rnd.random() < 0.5:
+                conn.execute("SELECT * FROM builds WHERE id = ?", (rnd.randint(1, n),)).fetchone()
+            else:
+                conn.execute("SELECT id, title, tabs FROM builds WHERE weapon_type = ? ORDER BY id DESC LIMIT 20",
+                             (f"type{rnd.randint(0, 7)}",)).fetchall()
+    reads = READS / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for i in range(WRITES):
+        with source.connection() as conn:
+            conn.execute("UPDATE builds SET title = ? WHERE id = ?", (f"Build {i}*", rnd.randint(1, n)))
+    writes = WRITES / (time.perf_counter() - started)
+    return reads, writes
+
+
+def main(n: int):
+    tmp = Path(tempfile.mkdtemp())
+    sources = {
+        "per-call connect": lambda p: PerCallConnect(p),
+        "pool, base": lambda p: storage.ConnectionPool(p, pragmas=storage.BASE_PRAGMAS, cached_statements=128),
+        "pool, tuned": lambda p: storage.ConnectionPool(p, pragmas=storage.TUNED_PRAGMAS),
+    }
+    print(f"{n:,} builds, {READS} read calls, {WRITES} single-row write transactions")
+    baseline = None
+    for name, make in sources.items():
+        path = tmp / f"{name.replace(' ', '_').replace(',', '')}.db"
+        fill(path, n)
+        source = make(path)
+        reads, writes = run(source, n)
+        source.close()
+        baseline = baseline or (reads, writes)
+        print(f"{name:>18}: reads {reads:>8,.0f}/s (x{reads / baseline[0]:4.1f}) | "
+              f"writes {writes:>7,.0f}/s (x{writes / baseline[1]:4.1f})")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if sys.argv[1:] else 5000)
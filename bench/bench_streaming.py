@@ -0,0 +1,103 @@
+"""
+Пиковая память: список dict'ов + json.dumps против потоковой отдачи из курсора.
+
+    python bench/bench_streaming.py [rows ...]
+
+Меряем пиковый RSS процесса (ru_maxrss), а не tracemalloc: тот не видит память
+SQLite и аллокатора. Каждый случай — отдельный подпроцесс; колонка idle — пик
+того же подпроцесса без работы (интерпретатор + импорты). Работает на временной БД со схемой bf_builds,
+реальные базы не трогает.
+"""
+import json
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from json_stream import iter_json_array  # noqa: E402
+
+TABS = [{"label": f"Вкладка {i}", "items": ["Monolithic Suppressor", "Gain-Twist Barrel", "Ported Compencator",
+                                             "Personal Choice", "Extended Mag"]} for i in range(3)]
+
+
+def make_db(path: Path, rows: int):
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE bf_builds (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, weapon_type TEXT,
+                    top1 TEXT, top2 TEXT, top3 TEXT, date TEXT, tabs TEXT, categories TEXT, mode TEXT)""")
+    conn.executemany(
+        "INSERT INTO bf_builds (title, weapon_type, top1, top2, top3, date, tabs, categories, mode) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        # генератор, а не список: ru_maxrss родителя наследуется подпроцессами через exec
+        ((f"Build {i}", "assault", "#1", "", "", "01.01.2025", json.dumps(TABS), '["Мета"]', "mp")
+         for i in range(rows))
+    )
+    conn.commit()
+    conn.close()
+
+
+def row_to_dict(r):
+    b = dict(r)
+    b["tabs"] = json.loads(b["tabs"])
+    b["categories"] = json.loads(b["categories"])
+    return b
+
+
+def full_list(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("SELECT * FROM bf_builds ORDER BY id DESC").fetchall()
+    builds = [row_to_dict(r) for r in rows]
+    conn.close()
+    body = json.dumps(builds, ensure_ascii=False).encode()
+    return len(body)
+
+
+def streamed(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    cur = conn.execute("SELECT * FROM bf_builds ORDER BY id DESC")
+    size = sum(len(chunk.encode()) for chunk in iter_json_array(row_to_dict(r) for r in cur))
+    conn.close()
+    return size
+
+
+CASES = {"idle": lambda path: 0, "list+dumps": full_list, "stream": streamed}
+
+
+def max_rss_kb() -> int:
+    # ru_maxrss: на Linux в килобайтах, на macOS — в байтах
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def run_case(case: str, path: str):
+    """Запускается в подпроцессе: печатает «размер тела, пиковый RSS в KB»."""
+    size = CASES[case](path)
+    print(size, max_rss_kb())
+
+
+def peak(case: str, path: Path) -> tuple[int, int]:
+    out = subprocess.run([sys.executable, __file__, "--case", case, str(path)],
+                         check=True, capture_output=True, text=True).stdout
+    size, rss = out.split()
+    return int(size), int(rss)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--case"]:
+        run_case(sys.argv[2], sys.argv[3])
+        sys.exit()
+
+    sizes = [int(x) for x in sys.argv[1:]] or [1_000, 5_000, 20_000]
+    print(f"{'rows':>8} {'body, KB':>10} {'idle RSS, KB':>14} {'list+dumps RSS, KB':>20} {'stream RSS, KB':>16}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            path = Path(tmp) / f"bf_builds_{n}.db"
+            make_db(path, n)
+            _, idle = peak("idle", path)
+            body, full_peak = peak("list+dumps", path)
+            _, stream_peak = peak("stream", path)
+            print(f"{n:>8} {body // 1024:>10} {idle:>14} {full_peak:>20} {stream_peak:>16}")
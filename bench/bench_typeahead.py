@@ -0,0 +1,73 @@
+"""
+Подсказки модулей: LIKE '%q%' в SQLite против индекса typeahead.ModuleIndex.
+
+    python bench/bench_typeahead.py [modules ...]
+
+В репозитории ~400 модулей (data/modules-*.json); большие размеры — запас.
+
+Работает на временной БД со схемой weapon_modules, реальные базы не трогает.
+"""
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from typeahead import ModuleIndex  # noqa: E402
+
+TYPES = ["assault", "pp", "shv", "snayperki", "pulemet", "drobovik", "pehotnye"]
+CATEGORIES = ["Дуло", "Ствол", "Магазин", "Прицел", "Приклад", "Рукоять", "Лазер", "Подствольник"]
+WORDS_EN = ["Monolithic", "Suppressor", "Barrel", "Compensator", "Extended", "Mag", "Optic", "Stock", "Grip", "Laser"]
+WORDS_RU = ["Глушитель", "Ствол", "Компенсатор", "Ёмкий", "Магазин", "Прицел", "Приклад", "Рукоять", "Лазер", "Тяжёлый"]
+QUERIES = ["г", "гл", "ем", "магаз", "su", "compe", "laser", "тяжел", "xyz"]
+
+
+def make_rows(n: int):
+    rows = []
+    for i in range(n):
+        en = f"{WORDS_EN[i % 10]} {WORDS_EN[(i // 10) % 10]} {i}"
+        ru = f"{WORDS_RU[i % 10]} {WORDS_RU[(i // 7) % 10]} {i}"
+        rows.append((TYPES[i % len(TYPES)], CATEGORIES[i % len(CATEGORIES)], en.lower(), ru, i))
+    return rows
+
+
+def main(n: int):
+    conn = sqlite3.connect(tempfile.mktemp(suffix=".db"))
+    conn.execute("""CREATE TABLE weapon_modules (id INTEGER PRIMARY KEY AUTOINCREMENT, weapon_type TEXT,
+                    category TEXT, en TEXT, ru TEXT, pos INTEGER)""")
+    conn.execute("CREATE INDEX wm_idx ON weapon_modules(weapon_type, category, pos)")
+    conn.executemany("INSERT INTO weapon_modules (weapon_type, category, en, ru, pos) VALUES (?, ?, ?, ?, ?)",
+                     make_rows(n))
+    conn.commit()
+
+    rounds = 50
+    t = time.perf_counter()
+    for _ in range(rounds):
+        for q in QUERIES:
+            like = f"%{q}%"
+            conn.execute("""SELECT id, weapon_type, category, en, ru, pos FROM weapon_modules
+                            WHERE en LIKE ? OR ru LIKE ? ORDER BY category, pos, ru LIMIT 20""",
+                         (like, like)).fetchall()
+    like_us = (time.perf_counter() - t) / (rounds * len(QUERIES)) * 1e6
+
+    snapshot = {}
+    for r in conn.execute("SELECT id, weapon_type, category, en, ru, pos FROM weapon_modules"):
+        snapshot.setdefault(r[1], {}).setdefault(r[2], []).append({"id": r[0], "en": r[3], "ru": r[4], "pos": r[5]})
+    t = time.perf_counter()
+    index = ModuleIndex(1, snapshot)
+    build_ms = (time.perf_counter() - t) * 1000
+
+    t = time.perf_counter()
+    for _ in range(rounds):
+        for q in QUERIES:
+            index.search(q, limit=20)
+    index_us = (time.perf_counter() - t) / (rounds * len(QUERIES)) * 1e6
+
+    print(f"{n:>6} modules | LIKE {like_us:8.1f} us/query | index {index_us:7.1f} us/query "
+          f"| index build {build_ms:6.1f} ms")
+
+
+if __name__ == "__main__":
+    for arg in sys.argv[1:] or ["400", "2000", "10000"]:
+        main(int(arg))
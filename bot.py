@@ -1,5 +1,4 @@
 import os
-import sqlite3
 import asyncio
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, F
@@ -13,14 +12,13 @@ from aiogram.types import (
 from aiogram import BaseMiddleware, Router
 from aiogram.exceptions import TelegramBadRequest
 from typing import Callable, Awaitable, Dict, Any
-from database import save_user, init_db
+from database import save_user, init_db, register_user, set_user_verified
 
 # --- env ---
 load_dotenv("/opt/ndloadouts/.env")
 BOT_TOKEN = os.getenv("TOKEN")
 WEBAPP_URL = os.getenv("WEBAPP_URL")
 CHANNEL_ID = int(os.getenv("CHANNEL_ID", "-1001990222164"))  # обязательно со знаком минус
-DB_PATH = "/opt/ndloadouts_storage/builds.db"
 
 if not BOT_TOKEN or not WEBAPP_URL:
     raise ValueError("❌ BOT_TOKEN и WEBAPP_URL должны быть заданы в .env")
@@ -125,15 +123,12 @@ async def start_handler(message: Message):
     user_id = int(message.from_user.id)
     subscribed = await is_subscribed(user_id)
 
+    # Запись через очередь builds.db (см. database._writes); в потоке — чтобы не стопорить polling
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            cur = conn.cursor()
-            cur.execute(
-                "INSERT OR IGNORE INTO users(id, first_name, username, verified) VALUES(?, ?, ?, 0)",
-                (str(user_id), message.from_user.first_name or "", message.from_user.username or "")
-            )
-            cur.execute("UPDATE users SET verified = ? WHERE id = ?", (1 if subscribed else 0, str(user_id)))
-            conn.commit()
+        await asyncio.to_thread(
+            register_user, str(user_id), message.from_user.first_name or "",
+            message.from_user.username or "", subscribed
+        )
     except Exception as e:
         print(f"[DB ERROR] {e}")
 
@@ -168,16 +163,15 @@ async def recheck_subscription(callback: CallbackQuery):
     print(f"[DEBUG] recheck | user_id={user_id} | subscribed={subscribed}")
 
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            cur = conn.cursor()
-            cur.execute("UPDATE users SET verified = ? WHERE id = ?", (1 if subscribed else 0, str(user_id)))
-            conn.commit()
+        await asyncio.to_thread(set_user_verified, str(user_id), subscribed)
     except Exception as e:
         print(f"[DB ERROR] {e}")
 
     if subscribed:
         try:
-            save_user(str(user_id), callback.from_user.first_name or "", callback.from_user.username or "")
+            await asyncio.to_thread(
+                save_user, str(user_id), callback.from_user.first_name or "", callback.from_user.username or ""
+            )
         except Exception as e:
             print(f"[DB ERROR] save_user: {e}")
         try:
@@ -1,8 +1,14 @@
-import sqlite3
+import ast
 import json
+import time
+import functools
+import threading
 from pathlib import Path
+from collections import OrderedDict
 from datetime import datetime
-from contextlib import contextmanager
+
+import storage
+from typeahead import ModuleIndex
 
 DB_PATH = Path("/opt/ndloadouts_storage/builds.db")
 DB_PATH.parent.mkdir(exist_ok=True)
@@ -11,22 +17,21 @@ DB_PATH.parent.mkdir(exist_ok=True)
 # Общие утилиты для SQLite
 # ========================
 
-@contextmanager
 def get_conn(row_mode: bool = False):
-    conn = sqlite3.connect(DB_PATH)
-    if row_mode:
-        conn.row_factory = sqlite3.Row
-    try:
-        # Включим внешние ключи и WAL (однократно; если уже стоит — ок)
-        conn.execute("PRAGMA foreign_keys = ON")
-        try:
-            conn.execute("PRAGMA journal_mode = WAL")
-        except sqlite3.DatabaseError:
-            pass
-        yield conn
-        conn.commit()
-    finally:
-        conn.close()
+    # Соединение из пула storage: WAL и внешние ключи включаются один раз при открытии,
+    # commit при выходе из with, rollback при исключении
+    return storage.connection(DB_PATH, row_mode)
+
+def _writes(fn):
+    """
+    Пишущая функция выполняется очередью записи builds.db (storage.write):
+    один поток-писатель, накопившиеся записи фиксируются общей транзакцией.
+    Тело функции не меняется — его with get_conn() входит в транзакцию писателя.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return storage.write(DB_PATH, fn, *args, **kwargs)
+    return wrapper
 
 # ========================
 # ИНИЦИАЛИЗАЦИЯ БАЗЫ
@@ -48,7 +53,9 @@ def init_db():
                 tabs_json TEXT,
                 image TEXT,
                 date TEXT,
-                categories TEXT
+                categories TEXT,              -- устарело: членство в категориях живёт в build_categories
+                date_ts INTEGER DEFAULT 0,    -- дата в epoch (для сортировки)
+                priority INTEGER DEFAULT 999  -- 1/2/3 по top1/top2/top3, иначе 999
             )
         """)
 
@@ -57,7 +64,8 @@ def init_db():
             CREATE TABLE IF NOT EXISTS users (
                 id TEXT PRIMARY KEY,
                 first_name TEXT,
-                username TEXT
+                username TEXT,
+                verified INTEGER DEFAULT 0   -- подписан на канал (пишет бот)
             )
         """)
 
@@ -85,32 +93,322 @@ def init_db():
         c.execute("CREATE INDEX IF NOT EXISTS wm_idx ON weapon_modules(weapon_type, category)")
         # При желании можно сделать кейс-инсенситивность для en через COLLATE NOCASE на уровне таблицы.
 
+    init_exclusive_categories()
+    init_build_changes()
+    add_sort_columns_if_not_exists()
+    migrate_build_categories()
+    init_build_module_usage()
+    add_users_verified_column_if_not_exists()
+
 # ====== СБОРКИ ======
 
+def _top_priority(build) -> int:
+    if build.get("top1"): return 1
+    if build.get("top2"): return 2
+    if build.get("top3"): return 3
+    return 999
+
+def _date_ts(build) -> int:
+    s = (build.get("date") or "").strip()
+    for fmt in ("%d.%m.%Y", "%Y-%m-%d", "%Y.%m.%d"):
+        try:
+            return int(datetime.strptime(s, fmt).timestamp())
+        except Exception:
+            continue
+    return 0
+
+# Колонки списка в порядке выдачи; sort-ключи нужны только для курсора
+BUILD_COLUMNS = "b.id, b.title, b.weapon_type, b.top1, b.top2, b.top3, b.tabs_json, b.image, b.date, b.priority, b.date_ts"
+# Summary-проекция для списков: без tabs_json (основной объём), только число вкладок
+BUILD_SUMMARY_COLUMNS = (
+    "b.id, b.title, b.weapon_type, b.top1, b.top2, b.top3, b.image, b.date, b.priority, b.date_ts, "
+    "CASE WHEN json_valid(b.tabs_json) THEN json_array_length(b.tabs_json) ELSE 0 END AS tabs_count"
+)
+BUILDS_ORDER = "ORDER BY b.priority ASC, b.date_ts DESC, b.id DESC"
+
+def _build_from_row(row) -> dict:
+    build = {
+        "id": row["id"],
+        "title": row["title"],
+        "weapon_type": row["weapon_type"],
+        "top1": row["top1"],
+        "top2": row["top2"],
+        "top3": row["top3"],
+        "image": row["image"],
+        "date": row["date"],
+        "categories": []
+    }
+    if "tabs_json" in row.keys():
+        build["tabs"] = json.loads(row["tabs_json"] or "[]")
+    else:
+        build["tabs_count"] = row["tabs_count"]
+    return build
+
+def _parse_legacy_categories(raw) -> list:
+    """Старый builds.categories: JSON или str(list) от прежнего кода уникальных категорий."""
+    if not raw:
+        return []
+    try:
+        cats = json.loads(raw)
+    except ValueError:
+        try:
+            cats = ast.literal_eval(raw)
+        except (ValueError, SyntaxError):
+            return []
+    return [str(c) for c in cats] if isinstance(cats, (list, tuple)) else []
+
+def _attach_categories(conn, builds: list):
+    """Подтягивает категории из build_categories только для переданных сборок."""
+    by_id = {b["id"]: b for b in builds}
+    ids = list(by_id)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        rows = conn.execute(
+            f"SELECT build_id, category FROM build_categories "
+            f"WHERE build_id IN ({','.join('?' * len(chunk))}) ORDER BY build_id, pos",
+            chunk
+        ).fetchall()
+        for build_id, category in rows:
+            by_id[build_id]["categories"].append(category)
+
+def _replace_build_categories(conn, build_id: int, categories: list):
+    conn.execute("DELETE FROM build_categories WHERE build_id = ?", (build_id,))
+    conn.executemany(
+        "INSERT OR IGNORE INTO build_categories (build_id, category, pos) VALUES (?, ?, ?)",
+        [(build_id, str(cat), pos) for pos, cat in enumerate(categories)]
+    )
+
+def _save_build_categories(conn, build_id: int, categories: list):
+    _replace_build_categories(conn, build_id, categories)
+    # Эксклюзивные категории («Новинки», «Популярное», ...) может носить только одна сборка:
+    # снимаем их с остальных одним запросом в той же транзакции, что и запись сборки
+    # (затронутые сборки сначала попадают в ленту изменений).
+    taken_elsewhere = """
+        FROM build_categories
+        WHERE build_id != ? AND category IN (
+            SELECT bc.category FROM build_categories bc
+            JOIN exclusive_categories ec ON ec.category = bc.category
+            WHERE bc.build_id = ?
+        )
+    """
+    conn.execute(
+        f"INSERT INTO build_changes (build_id, op, changed_at) "
+        f"SELECT DISTINCT build_id, 'upsert', ? {taken_elsewhere}",
+        (datetime.now().isoformat(), build_id, build_id)
+    )
+    conn.execute(f"DELETE {taken_elsewhere}", (build_id, build_id))
+
+def _log_build_change(conn, build_id: int, op: str):
+    """
+    Пишет событие в ленту build_changes (revision = rowid, растёт монотонно)
+    и подрезает хвост, чтобы таблица не росла бесконечно.
+    """
+    conn.execute(
+        "INSERT INTO build_changes (build_id, op, changed_at) VALUES (?, ?, ?)",
+        (build_id, op, datetime.now().isoformat())
+    )
+    conn.execute(
+        "DELETE FROM build_changes WHERE revision <= (SELECT MAX(revision) FROM build_changes) - ?",
+        (BUILD_CHANGES_KEEP,)
+    )
+
+def _build_module_keys(data) -> list[str]:
+    """Нормализованные ключи модулей сборки (top1..3 и tabs[].items) без повторов и пустых."""
+    keys = [data.get(top) for top in ("top1", "top2", "top3")]
+    for tab in data.get("tabs") or []:
+        if isinstance(tab, dict) and isinstance(tab.get("items"), list):
+            keys.extend(tab["items"])
+    return list(dict.fromkeys(k for k in map(_norm_module_key, keys) if k))
+
+def _index_build_modules(conn, build_id: int, weapon_type: str, keys: list):
+    """Перезаписывает строки сборки в build_module_usage; категория — из weapon_modules."""
+    conn.execute("DELETE FROM build_module_usage WHERE build_id = ?", (build_id,))
+    conn.executemany("""
+        INSERT OR IGNORE INTO build_module_usage (build_id, weapon_type, category, module_en)
+        VALUES (?, ?, (SELECT category FROM weapon_modules WHERE weapon_type = ? AND en = ? ORDER BY pos LIMIT 1), ?)
+    """, [(build_id, weapon_type, weapon_type, key, key) for key in keys])
+
+def _refresh_usage_categories(conn, weapon_types):
+    """После правок справочника: пересчитать категории в build_module_usage для типов."""
+    conn.executemany("""
+        UPDATE build_module_usage
+        SET category = (
+            SELECT wm.category FROM weapon_modules wm
+            WHERE wm.weapon_type = build_module_usage.weapon_type AND wm.en = build_module_usage.module_en
+            ORDER BY wm.pos LIMIT 1
+        )
+        WHERE weapon_type = ?
+    """, [(t,) for t in weapon_types])
+
 def get_all_builds():
+    with get_conn(row_mode=True) as conn:
+        rows = conn.execute(f"SELECT {BUILD_COLUMNS} FROM builds b ORDER BY b.id DESC").fetchall()
+        builds = [_build_from_row(r) for r in rows]
+        _attach_categories(conn, builds)
+    return builds
+
+def encode_builds_cursor(priority: int, date_ts: int, build_id: int) -> str:
+    return f"{priority}.{date_ts}.{build_id}"
+
+def decode_builds_cursor(cursor: str) -> tuple[int, int, int]:
+    """Курсор вида '<priority>.<date_ts>.<id>'; ValueError, если битый."""
+    priority, date_ts, build_id = (int(x) for x in cursor.split("."))
+    return priority, date_ts, build_id
+
+def get_build_by_id(build_id: int) -> dict | None:
+    """Полная сборка (с вкладками) — для раскрытия карточки из summary-списка."""
+    with get_conn(row_mode=True) as conn:
+        row = conn.execute(f"SELECT {BUILD_COLUMNS} FROM builds b WHERE b.id = ?", (build_id,)).fetchone()
+        if not row:
+            return None
+        build = _build_from_row(row)
+        _attach_categories(conn, [build])
+    return build
+
+def get_builds_page(category: str = "all", limit: int | None = None, after: str | None = None,
+                    summary: bool = False):
+    """
+    Сборки в порядке top-приоритета и свежести даты (сортирует SQLite по builds_sort_idx).
+    limit/after — keyset-пагинация: after это курсор последней сборки предыдущей страницы.
+    summary=True — без tabs (вместо них tabs_count), tabs_json даже не читается.
+    Возвращает (builds, next_cursor); next_cursor = None, если дальше пусто.
+    """
+    columns = BUILD_SUMMARY_COLUMNS if summary else BUILD_COLUMNS
+    where, params = [], []
+    q = f"SELECT {columns} FROM builds b"
+    if category != "all":
+        # Фильтр через индекс build_categories_idx: работа ~ размеру результата
+        q = f"SELECT {columns} FROM build_categories bc JOIN builds b ON b.id = bc.build_id"
+        where.append("bc.category = ?")
+        params.append(category)
+    if after:
+        p, d, i = decode_builds_cursor(after)
+        where.append("(b.priority > ? OR (b.priority = ? AND (b.date_ts < ? OR (b.date_ts = ? AND b.id < ?))))")
+        params += [p, p, d, d, i]
+
+    if where:
+        q += " WHERE " + " AND ".join(where)
+    q += " " + BUILDS_ORDER
+    if limit:
+        q += " LIMIT ?"
+        params.append(limit)
+
+    with get_conn(row_mode=True) as conn:
+        rows = conn.execute(q, params).fetchall()
+        builds = [_build_from_row(r) for r in rows]
+        _attach_categories(conn, builds)
+
+    next_cursor = None
+    if limit and len(rows) == limit:
+        last = rows[-1]
+        next_cursor = encode_builds_cursor(last["priority"], last["date_ts"], last["id"])
+    return builds, next_cursor
+
+# ====== ЛЕНТА ИЗМЕНЕНИЙ ======
+# Каждая запись сборки добавляет строку в build_changes; клиент хранит последнюю
+# увиденную ревизию и докачивает только изменения после неё.
+
+BUILD_CHANGES_KEEP = 5000  # столько последних событий храним
+
+def get_builds_revision() -> int:
     with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("SELECT * FROM builds ORDER BY id DESC")
-        rows = c.fetchall()
-        columns = [desc[0] for desc in c.description]
+        row = conn.execute("SELECT MAX(revision) FROM build_changes").fetchone()
+    return row[0] or 0
 
-    builds = []
-    for row in rows:
-        row_dict = dict(zip(columns, row))
-        builds.append({
-            "id": row_dict["id"],
-            "title": row_dict["title"],
-            "weapon_type": row_dict["weapon_type"],
-            "top1": row_dict["top1"],
-            "top2": row_dict["top2"],
-            "top3": row_dict["top3"],
-            "tabs": json.loads(row_dict.get("tabs_json") or "[]"),
-            "image": row_dict.get("image"),
-            "date": row_dict.get("date"),
-            "categories": json.loads(row_dict.get("categories") or "[]")
-        })
-    return builds
+def get_build_changes(since: int) -> dict:
+    """
+    Изменения после ревизии since:
+    {"revision": текущая, "reset": bool, "upserts": [сборки], "deletes": [id]}.
+    reset=True — since вне хранимой истории: в upserts весь список, локальную копию заменить.
+    """
+    with get_conn(row_mode=True) as conn:
+        revision, oldest = conn.execute(
+            "SELECT MAX(revision), MIN(revision) FROM build_changes"
+        ).fetchone()
+        revision = revision or 0
+
+        if since == revision:
+            return {"revision": revision, "reset": False, "upserts": [], "deletes": []}
+
+        # since из будущего (база пересоздана) или старше хранимой истории — полный список
+        if since > revision or oldest is None or since < oldest - 1:
+            rows = conn.execute(f"SELECT {BUILD_COLUMNS} FROM builds b {BUILDS_ORDER}").fetchall()
+            builds = [_build_from_row(r) for r in rows]
+            _attach_categories(conn, builds)
+            return {"revision": revision, "reset": True, "upserts": builds, "deletes": []}
+
+        changed = [r[0] for r in conn.execute(
+            "SELECT DISTINCT build_id FROM build_changes WHERE revision > ? AND revision <= ?",
+            (since, revision)
+        )]
+        builds = []
+        for i in range(0, len(changed), 500):
+            chunk = changed[i:i + 500]
+            rows = conn.execute(
+                f"SELECT {BUILD_COLUMNS} FROM builds b "
+                f"WHERE b.id IN ({','.join('?' * len(chunk))}) {BUILDS_ORDER}",
+                chunk
+            ).fetchall()
+            builds += [_build_from_row(r) for r in rows]
+        _attach_categories(conn, builds)
+
+    alive = {b["id"] for b in builds}
+    return {
+        "revision": revision,
+        "reset": False,
+        "upserts": builds,
+        "deletes": [build_id for build_id in changed if build_id not in alive],
+    }
+
+# ====== КЭШ СБОРОК ======
+# Сборки меняются несколько раз в день, а читаются на каждом открытии экрана.
+# Держим уже распарсенные страницы по ключу (category, limit, after); любая запись
+# сбрасывает кэш и поднимает версию (её же отдаём клиенту как ETag).
+
+BUILDS_CACHE_MAX_KEYS = 256
+
+_builds_cache_lock = threading.Lock()
+_builds_cache_version = int(time.time() * 1000)  # уникально между перезапусками
+_builds_cache: dict[tuple, tuple] = {}
 
+def builds_cache_version() -> int:
+    with _builds_cache_lock:
+        return _builds_cache_version
+
+def invalidate_builds_cache():
+    # Из очереди записи — только после общего COMMIT, иначе читатель закэширует старое под новой версией
+    storage.after_commit(_bump_builds_cache)
+
+def _bump_builds_cache():
+    global _builds_cache_version
+    with _builds_cache_lock:
+        _builds_cache_version += 1
+        _builds_cache.clear()
+
+def get_builds_cached(category: str = "all", limit: int | None = None, after: str | None = None,
+                      summary: bool = False):
+    """
+    Возвращает (version, builds, next_cursor) — см. get_builds_page.
+    Список общий для всех запросов — не мутировать.
+    """
+    key = (category, limit, after, summary)
+    with _builds_cache_lock:
+        version = _builds_cache_version
+        cached = _builds_cache.get(key)
+    if cached is not None:
+        return (version, *cached)
+
+    builds, next_cursor = get_builds_page(category, limit, after, summary)
+
+    with _builds_cache_lock:
+        # Пока читали — могла пройти запись; устаревшую страницу не кладём
+        if version == _builds_cache_version:
+            if len(_builds_cache) >= BUILDS_CACHE_MAX_KEYS:
+                _builds_cache.clear()
+            _builds_cache[key] = (builds, next_cursor)
+    return version, builds, next_cursor
+
+@_writes
 def add_build(data):
     tabs = data.get("tabs") or []
     if not isinstance(tabs, list):
@@ -123,8 +421,9 @@ def add_build(data):
     with get_conn() as conn:
         c = conn.cursor()
         c.execute("""
-            INSERT INTO builds (title, weapon_type, top1, top2, top3, tabs_json, image, date, categories)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO builds (title, weapon_type, top1, top2, top3, tabs_json, image, date,
+                                priority, date_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (
             data["title"],
             data["weapon_type"],
@@ -134,13 +433,23 @@ def add_build(data):
             json.dumps(tabs, ensure_ascii=False),
             data.get("image"),
             data.get("date"),
-            json.dumps(categories, ensure_ascii=False)
+            _top_priority(data),
+            _date_ts(data)
         ))
+        _save_build_categories(conn, c.lastrowid, categories)
+        _index_build_modules(conn, c.lastrowid, data["weapon_type"], _build_module_keys({**data, "tabs": tabs}))
+        _log_build_change(conn, c.lastrowid, "upsert")
+    invalidate_builds_cache()
 
+@_writes
 def delete_build_by_id(build_id: str):
     with get_conn() as conn:
-        conn.execute("DELETE FROM builds WHERE id = ?", (build_id,))
+        cur = conn.execute("DELETE FROM builds WHERE id = ?", (build_id,))
+        if cur.rowcount:
+            _log_build_change(conn, int(build_id), "delete")
+    invalidate_builds_cache()
 
+@_writes
 def update_build_by_id(build_id, data):
     tabs = data.get("tabs") or []
     if not isinstance(tabs, list):
@@ -151,9 +460,10 @@ def update_build_by_id(build_id, data):
         categories = ["all"]
 
     with get_conn() as conn:
-        conn.execute("""
+        cur = conn.execute("""
             UPDATE builds
-            SET title = ?, weapon_type = ?, top1 = ?, top2 = ?, top3 = ?, tabs_json = ?, date = ?, categories = ?
+            SET title = ?, weapon_type = ?, top1 = ?, top2 = ?, top3 = ?, tabs_json = ?, date = ?,
+                priority = ?, date_ts = ?
             WHERE id = ?
         """, (
             data["title"],
@@ -163,12 +473,100 @@ def update_build_by_id(build_id, data):
             data.get("top3", ""),
             json.dumps(tabs, ensure_ascii=False),
             data.get("date", ""),
-            json.dumps(categories, ensure_ascii=False),
+            _top_priority(data),
+            _date_ts(data),
             build_id
         ))
+        if cur.rowcount:
+            _save_build_categories(conn, int(build_id), categories)
+            _index_build_modules(conn, int(build_id), data["weapon_type"], _build_module_keys({**data, "tabs": tabs}))
+            _log_build_change(conn, int(build_id), "upsert")
+    invalidate_builds_cache()
+
+def init_build_changes():
+    """
+    Лента изменений сборок. При создании засеваем её текущими сборками,
+    чтобы клиент с since=0 получил полный список.
+    """
+    with get_conn() as conn:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'build_changes'"
+        ).fetchone()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS build_changes (
+                revision   INTEGER PRIMARY KEY AUTOINCREMENT,
+                build_id   INTEGER NOT NULL,
+                op         TEXT NOT NULL,      -- upsert | delete
+                changed_at TEXT
+            )
+        """)
+        if not exists:
+            conn.execute("""
+                INSERT INTO build_changes (build_id, op, changed_at)
+                SELECT id, 'upsert', ? FROM builds ORDER BY id
+            """, (datetime.now().isoformat(),))
+
+# ====== ЭКСКЛЮЗИВНЫЕ КАТЕГОРИИ ======
+
+DEFAULT_EXCLUSIVE_CATEGORIES = ("Новинки", "Популярное")
+
+def init_exclusive_categories():
+    """
+    Категории, которые одновременно может иметь только одна сборка.
+    Дефолтные значения кладём только при создании таблицы — дальше список ведут админы.
+    """
+    with get_conn() as conn:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'exclusive_categories'"
+        ).fetchone()
+        conn.execute("CREATE TABLE IF NOT EXISTS exclusive_categories (category TEXT PRIMARY KEY)")
+        if not exists:
+            conn.executemany(
+                "INSERT OR IGNORE INTO exclusive_categories (category) VALUES (?)",
+                [(c,) for c in DEFAULT_EXCLUSIVE_CATEGORIES]
+            )
+
+def get_exclusive_categories() -> list[str]:
+    with get_conn() as conn:
+        rows = conn.execute("SELECT category FROM exclusive_categories ORDER BY category").fetchall()
+    return [r[0] for r in rows]
+
+@_writes
+def add_exclusive_category(category: str):
+    """
+    Объявить категорию эксклюзивной. Уже размеченные сборки не трогаем —
+    правило сработает при следующем сохранении сборки с этой категорией.
+    """
+    with get_conn() as conn:
+        conn.execute("INSERT OR IGNORE INTO exclusive_categories (category) VALUES (?)", (category.strip(),))
+
+@_writes
+def delete_exclusive_category(category: str) -> int:
+    with get_conn() as conn:
+        cur = conn.execute("DELETE FROM exclusive_categories WHERE category = ?", (category,))
+        return cur.rowcount
 
 # ====== ПОЛЬЗОВАТЕЛИ ======
+# Имя/username нужны аналитике на каждое событие и /api/admins на каждого админа.
+# Держим последних USERS_CACHE_SIZE пользователей в LRU; save_user/register_user
+# обновляют запись после COMMIT. Бот пишет users из своего процесса — наш кэш об этом
+# не узнает, поэтому запись живёт не дольше USERS_CACHE_TTL секунд, дальше перечитываем.
+# Промахи не кэшируем: пользователь, созданный ботом, найдётся при следующем обращении.
+
+USERS_CACHE_SIZE = 4096
+USERS_CACHE_TTL = 60
+
+_users_lock = threading.Lock()
+_users_cache: "OrderedDict[str, tuple[dict, float]]" = OrderedDict()  # id -> (пользователь, когда положили)
+
+def _cache_user(user_id: str, first_name: str, username: str):
+    with _users_lock:
+        _users_cache[user_id] = ({"id": user_id, "first_name": first_name, "username": username}, time.monotonic())
+        _users_cache.move_to_end(user_id)
+        while len(_users_cache) > USERS_CACHE_SIZE:
+            _users_cache.popitem(last=False)
 
+@_writes
 def save_user(user_id: str, first_name: str, username: str = ""):
     with get_conn() as conn:
         conn.execute("""
@@ -178,6 +576,73 @@ def save_user(user_id: str, first_name: str, username: str = ""):
                 first_name = excluded.first_name,
                 username = excluded.username
         """, (user_id, first_name, username))
+    storage.after_commit(lambda: _cache_user(str(user_id), first_name, username))
+
+@_writes
+def register_user(user_id: str, first_name: str, username: str = "", verified: bool = False):
+    """
+    /start в боте: создать или обновить пользователя вместе с отметкой подписки на канал.
+    """
+    with get_conn() as conn:
+        conn.execute("""
+            INSERT INTO users (id, first_name, username, verified)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                first_name = excluded.first_name,
+                username = excluded.username,
+                verified = excluded.verified
+        """, (user_id, first_name, username, int(verified)))
+    storage.after_commit(lambda: _cache_user(str(user_id), first_name, username))
+
+@_writes
+def set_user_verified(user_id: str, verified: bool) -> int:
+    with get_conn() as conn:
+        cur = conn.execute("UPDATE users SET verified = ? WHERE id = ?", (int(verified), user_id))
+        return cur.rowcount
+
+def get_users(user_ids) -> dict:
+    """
+    {user_id: {"id", "first_name", "username"}} для переданных id (кого нет в users — нет и в ответе).
+    Сначала LRU (записи не старше USERS_CACHE_TTL), недостающие — одним запросом
+    по первичному ключу. Словари общие — не мутировать.
+    """
+    wanted = {str(uid) for uid in user_ids if uid is not None}
+    found = {}
+    read_at = time.monotonic()
+    with _users_lock:
+        for uid in wanted:
+            cached = _users_cache.get(uid)
+            if cached is not None and read_at - cached[1] < USERS_CACHE_TTL:
+                _users_cache.move_to_end(uid)
+                found[uid] = cached[0]
+    missing = list(wanted - found.keys())
+    if missing:
+        with get_conn() as conn:
+            for i in range(0, len(missing), 500):
+                chunk = missing[i:i + 500]
+                for uid, first_name, username in conn.execute(
+                    f"SELECT id, first_name, username FROM users WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                ):
+                    found[uid] = {"id": uid, "first_name": first_name, "username": username}
+        with _users_lock:
+            for uid in missing:
+                cached = _users_cache.get(uid)
+                # Положена после начала чтения — значит, save_user успел записать более свежую
+                if cached is not None and cached[1] >= read_at:
+                    continue
+                if uid in found:
+                    _users_cache[uid] = (found[uid], read_at)
+                    _users_cache.move_to_end(uid)
+                else:
+                    # Пользователя удалили (или его нет) — устаревшую запись не держим
+                    _users_cache.pop(uid, None)
+            while len(_users_cache) > USERS_CACHE_SIZE:
+                _users_cache.popitem(last=False)
+    return found
+
+def get_user(user_id) -> dict | None:
+    """Один пользователь по id (см. get_users) или None."""
+    return get_users([user_id]).get(str(user_id))
 
 def get_all_users():
     with get_conn() as conn:
@@ -194,6 +659,15 @@ def add_date_column_if_not_exists():
         if "date" not in columns:
             c.execute("ALTER TABLE builds ADD COLUMN date TEXT")
 
+def add_users_verified_column_if_not_exists():
+    """
+    users.verified пишет бот (подписка на канал); в старых базах колонки нет.
+    """
+    with get_conn() as conn:
+        columns = [col[1] for col in conn.execute("PRAGMA table_info(users)")]
+        if "verified" not in columns:
+            conn.execute("ALTER TABLE users ADD COLUMN verified INTEGER DEFAULT 0")
+
 def fill_empty_dates():
     today = datetime.now().strftime('%Y-%m-%d')
     with get_conn() as conn:
@@ -207,6 +681,89 @@ def add_categories_column_if_not_exists():
         if "categories" not in columns:
             c.execute("ALTER TABLE builds ADD COLUMN categories TEXT DEFAULT '[]'")
 
+def add_sort_columns_if_not_exists():
+    """
+    priority/date_ts считаются при записи; для старых строк — досчитываем здесь.
+    """
+    with get_conn(row_mode=True) as conn:
+        columns = [col[1] for col in conn.execute("PRAGMA table_info(builds)")]
+        added = False
+        if "priority" not in columns:
+            conn.execute("ALTER TABLE builds ADD COLUMN priority INTEGER DEFAULT 999")
+            added = True
+        if "date_ts" not in columns:
+            conn.execute("ALTER TABLE builds ADD COLUMN date_ts INTEGER DEFAULT 0")
+            added = True
+        if added:
+            rows = conn.execute("SELECT id, top1, top2, top3, date FROM builds").fetchall()
+            conn.executemany(
+                "UPDATE builds SET priority = ?, date_ts = ? WHERE id = ?",
+                [(_top_priority(dict(r)), _date_ts(dict(r)), r["id"]) for r in rows]
+            )
+        conn.execute("CREATE INDEX IF NOT EXISTS builds_sort_idx ON builds(priority, date_ts DESC, id DESC)")
+
+def migrate_build_categories():
+    """
+    Членство сборок в категориях — таблица build_categories (индексируется, фильтр через JOIN).
+    При первом создании таблицы переносим данные из старой JSON-колонки builds.categories.
+    Категории копируются как есть: эксклюзивность здесь не применяется.
+    """
+    with get_conn() as conn:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'build_categories'"
+        ).fetchone()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS build_categories (
+                build_id INTEGER NOT NULL REFERENCES builds(id) ON DELETE CASCADE,
+                category TEXT NOT NULL,
+                pos      INTEGER DEFAULT 0,   -- порядок категорий как их сохранил админ
+                PRIMARY KEY (build_id, category)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS build_categories_idx ON build_categories(category, build_id)")
+        if exists:
+            return
+
+        columns = [col[1] for col in conn.execute("PRAGMA table_info(builds)")]
+        if "categories" not in columns:
+            return
+        for build_id, raw in conn.execute("SELECT id, categories FROM builds").fetchall():
+            # не _save_build_categories: тот снимает эксклюзивные категории с соседних сборок
+            _replace_build_categories(conn, build_id, _parse_legacy_categories(raw))
+
+def init_build_module_usage():
+    """
+    Обратный индекс «модуль → сборки»: build_module_usage поддерживается CRUD сборок.
+    При первом создании таблицы заполняем его по всем существующим сборкам.
+    """
+    with get_conn() as conn:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'build_module_usage'"
+        ).fetchone()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS build_module_usage (
+                build_id    INTEGER NOT NULL REFERENCES builds(id) ON DELETE CASCADE,
+                weapon_type TEXT NOT NULL,
+                category    TEXT,            -- категория из weapon_modules; NULL — ключа нет в справочнике
+                module_en   TEXT NOT NULL,   -- нормализованный ключ, как weapon_modules.en
+                PRIMARY KEY (build_id, module_en)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS bmu_module_idx ON build_module_usage(weapon_type, module_en)")
+        conn.execute("CREATE INDEX IF NOT EXISTS wm_en_idx ON weapon_modules(weapon_type, en)")
+        if exists:
+            return
+
+        for build_id, weapon_type, top1, top2, top3, tabs_json in conn.execute(
+            "SELECT id, weapon_type, top1, top2, top3, tabs_json FROM builds"
+        ).fetchall():
+            try:
+                tabs = json.loads(tabs_json or "[]")
+            except ValueError:
+                tabs = []
+            keys = _build_module_keys({"top1": top1, "top2": top2, "top3": top3, "tabs": tabs})
+            _index_build_modules(conn, build_id, weapon_type or "", keys)
+
 # =========================
 # СПРАВОЧНИК МОДУЛЕЙ (CRUD)
 # =========================
@@ -240,6 +797,172 @@ def modules_grouped_by_category(weapon_type: str):
         })
     return grouped
 
+# Скомпилированный снимок всего weapon_modules: {weapon_type: {category: [{id,en,ru,pos}]}}.
+# Полностью строится один раз; запись в модуль помечает устаревшим только его тип —
+# при следующем чтении перечитывается один тип, ревизия растёт с каждой записью.
+_modules_lock = threading.Lock()
+_modules_revision = int(time.time() * 1000)
+_modules_snapshot: dict[str, dict] | None = None
+_modules_stale_types: set[str] = set()
+
+def _group_modules(rows) -> dict:
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row["weapon_type"], {}).setdefault(row["category"], []).append({
+            "id": row["id"], "en": row["en"], "ru": row["ru"], "pos": row["pos"]
+        })
+    return grouped
+
+def modules_cache_version() -> int:
+    with _modules_lock:
+        return _modules_revision
+
+def invalidate_modules_cache(*weapon_types: str):
+    """
+    Пометить типы оружия устаревшими в снимке (без аргументов — весь снимок).
+    Из очереди записи — после общего COMMIT.
+    """
+    storage.after_commit(lambda: _bump_modules_cache(weapon_types))
+
+def _bump_modules_cache(weapon_types: tuple):
+    global _modules_revision, _modules_snapshot
+    with _modules_lock:
+        _modules_revision += 1
+        if not weapon_types:
+            _modules_snapshot = None
+            _modules_stale_types.clear()
+        else:
+            _modules_stale_types.update(weapon_types)
+
+def modules_snapshot() -> tuple[int, dict]:
+    """
+    (revision, {weapon_type: {category: [...]}}) — весь справочник. Словарь общий — не мутировать.
+    """
+    global _modules_snapshot
+    with _modules_lock:
+        revision = _modules_revision
+        snapshot = _modules_snapshot
+        stale = set(_modules_stale_types)
+    if snapshot is not None and not stale:
+        return revision, snapshot
+
+    if snapshot is None:
+        snapshot = _group_modules(modules_list())
+    else:
+        snapshot = dict(snapshot)
+        for weapon_type in stale:
+            grouped = _group_modules(modules_list(weapon_type)).get(weapon_type)
+            if grouped:
+                snapshot[weapon_type] = grouped
+            else:
+                snapshot.pop(weapon_type, None)
+
+    with _modules_lock:
+        # Пока читали — могла пройти ещё запись; тогда публикует следующий читатель
+        if revision == _modules_revision:
+            _modules_snapshot = snapshot
+            _modules_stale_types.clear()
+    return revision, snapshot
+
+def modules_grouped_cached(weapon_type: str) -> dict:
+    """
+    То же, что modules_grouped_by_category, но из снимка. Словарь общий — не мутировать.
+    """
+    return modules_snapshot()[1].get(weapon_type, {})
+
+def _norm_module_key(value) -> str:
+    # Как norm() в app.js: регистр и лишние пробелы не важны
+    return " ".join(str(value or "").lower().split())
+
+_module_lookup_cache: dict[str, tuple[int, dict]] = {}
+
+def module_lookup(weapon_type: str) -> dict:
+    """
+    en→ru справочник типа оружия: {норм. en: (ru, category)}.
+    Строится из кэша словарей и живёт, пока не сменится версия модулей.
+    """
+    version = modules_cache_version()
+    cached = _module_lookup_cache.get(weapon_type)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    lookup = {}
+    for category, mods in modules_grouped_cached(weapon_type).items():
+        for m in mods:
+            lookup[_norm_module_key(m["en"])] = (m["ru"], category)
+    _module_lookup_cache[weapon_type] = (version, lookup)
+    return lookup
+
+def localize_build(build: dict) -> dict:
+    """
+    Копия сборки с уже подставленными русскими названиями модулей:
+    top1..top3 и tabs[].items переводятся через module_lookup, в tabs[].slots —
+    категории модулей (то, что клиент раньше брал из словаря). Неизвестные ключи — как есть.
+    """
+    lookup = module_lookup(build.get("weapon_type") or "")
+    item = dict(build)
+    for top in ("top1", "top2", "top3"):
+        hit = lookup.get(_norm_module_key(build.get(top)))
+        if hit:
+            item[top] = hit[0]
+    if "tabs" in build:
+        tabs = []
+        for tab in build["tabs"] or []:
+            names, slots = [], []
+            for key in tab.get("items") or []:
+                ru, category = lookup.get(_norm_module_key(key), (key, None))
+                names.append(ru)
+                slots.append(category)
+            tabs.append({**tab, "items": names, "slots": slots})
+        item["tabs"] = tabs
+    return item
+
+def localize_builds(builds: list, lang: str = "ru") -> list:
+    if lang != "ru":
+        return builds
+    return [localize_build(b) for b in builds]
+
+# ====== КОМПАКТНЫЙ ФОРМАТ СБОРОК ======
+# Вместо повторяющихся en-названий в top1..3 и tabs[].items — id из weapon_modules.
+# Словарь (id → en/ru/category) клиент берёт один раз из /api/modules/all и кэширует по ETag.
+# Хранение в БД не меняется: это только формат выдачи.
+
+_module_id_cache: dict[str, tuple[int, dict]] = {}
+
+def module_id_lookup(weapon_type: str) -> dict:
+    """{норм. en: id} для типа оружия; живёт, пока не сменится версия модулей."""
+    version = modules_cache_version()
+    cached = _module_id_cache.get(weapon_type)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    ids = {}
+    for mods in modules_grouped_cached(weapon_type).values():
+        for m in mods:
+            ids.setdefault(_norm_module_key(m["en"]), m["id"])
+    _module_id_cache[weapon_type] = (version, ids)
+    return ids
+
+def compact_build(build: dict) -> dict:
+    """
+    Копия сборки, где известные модули заменены их id (int). Неизвестные ключи
+    остаются строками, так что клиент различает их по типу значения.
+    """
+    ids = module_id_lookup(build.get("weapon_type") or "")
+
+    def ref(key):
+        return ids.get(_norm_module_key(key), key) if key else key
+
+    item = dict(build)
+    for top in ("top1", "top2", "top3"):
+        item[top] = ref(build.get(top))
+    if "tabs" in build:
+        item["tabs"] = [{**tab, "items": [ref(k) for k in tab.get("items") or []]} for tab in build["tabs"] or []]
+    return item
+
+def compact_builds(builds: list) -> list:
+    return [compact_build(b) for b in builds]
+
 def modules_categories(weapon_type: str | None = None):
     """
     Список уникальных категорий. Если weapon_type=None — по всем типам.
@@ -278,6 +1001,29 @@ def modules_search(query: str, weapon_type: str | None = None, limit: int = 50):
         rows = conn.execute(q, params).fetchall()
     return [dict(r) for r in rows]
 
+# Индекс подсказок строится из снимка модулей и пересобирается при смене его ревизии
+_suggest_lock = threading.Lock()
+_suggest_index: ModuleIndex | None = None
+
+def modules_suggest_index() -> ModuleIndex:
+    global _suggest_index
+    revision, snapshot = modules_snapshot()
+    index = _suggest_index
+    if index is not None and index.revision == revision:
+        return index
+    with _suggest_lock:
+        if _suggest_index is None or _suggest_index.revision < revision:
+            _suggest_index = ModuleIndex(revision, snapshot)
+        return _suggest_index
+
+def modules_suggest(query: str, weapon_type: str | None = None, limit: int = 20) -> tuple[int, list[dict]]:
+    """
+    Подсказки по началу слова в en/ru без учёта регистра и ё/е: (revision, [модули]).
+    """
+    index = modules_suggest_index()
+    return index.revision, index.search(query, weapon_type, limit)
+
+@_writes
 def module_add_or_update(weapon_type: str, category: str, en: str, ru: str, pos: int = 0) -> int:
     """
     UPSERT: если (weapon_type, category, en) существует — обновим ru/pos.
@@ -305,30 +1051,328 @@ def module_add_or_update(weapon_type: str, category: str, en: str, ru: str, pos:
             SELECT id FROM weapon_modules
             WHERE weapon_type = ? AND category = ? AND en = ?
         """, (weapon_type, category, en_key)).fetchone()
-        return int(row[0])
+        _refresh_usage_categories(conn, [weapon_type])
+    invalidate_modules_cache(weapon_type)
+    return int(row[0])
 
+@_writes
 def module_update(module_id: int, *, category: str | None = None,
-                  en: str | None = None, ru: str | None = None, pos: int | None = None) -> int:
+                  en: str | None = None, ru: str | None = None, pos: int | None = None) -> dict:
+    """
+    Правка полей модуля. Смена en переносится в сборки его типа (top1..3 и tabs[].items)
+    в той же транзакции. Возвращает {"updated": строк модуля, "builds": затронутых сборок}.
+    """
     sets, vals = [], []
     if category is not None: sets.append("category = ?"); vals.append(category.strip())
     if en is not None:       sets.append("en = ?");       vals.append(en.strip().lower())
     if ru is not None:       sets.append("ru = ?");       vals.append(ru.strip())
     if pos is not None:      sets.append("pos = ?");      vals.append(int(pos))
     if not sets:
-        return 0
+        return {"updated": 0, "builds": 0}
     vals.append(module_id)
 
     with get_conn() as conn:
+        row = conn.execute("SELECT weapon_type, en FROM weapon_modules WHERE id = ?", (module_id,)).fetchone()
+        if not row:
+            return {"updated": 0, "builds": 0}
+        weapon_type, old_en = row
         cur = conn.execute(f"UPDATE weapon_modules SET {', '.join(sets)} WHERE id = ?", vals)
-        return cur.rowcount
+        touched = 0
+        if en is not None and _norm_module_key(en) != _norm_module_key(old_en):
+            touched = _propagate_module_rename(conn, weapon_type, old_en, en.strip())
+        if en is not None or category is not None:
+            _refresh_usage_categories(conn, [weapon_type])
+    invalidate_modules_cache(weapon_type)
+    if touched:
+        invalidate_builds_cache()
+    return {"updated": cur.rowcount, "builds": touched}
+
+def _propagate_module_rename(conn, weapon_type: str, old_en: str, new_en: str) -> int:
+    """
+    Переименовывает ключ модуля во всех сборках weapon_type. Кандидатов даёт индекс
+    build_module_usage, переписываются только реально изменившиеся строки.
+    Ищем по нормализованному ключу, а в сборки пишем new_en как его ввёл админ (с регистром).
+    Если старый ключ всё ещё принадлежит другому модулю типа (тот же en в другой категории) —
+    ссылки неоднозначны, сборки не трогаем. Возвращает число переписанных сборок.
+    """
+    old_key = _norm_module_key(old_en)
+    still_used = conn.execute(
+        "SELECT 1 FROM weapon_modules WHERE weapon_type = ? AND en = ? LIMIT 1", (weapon_type, old_key)
+    ).fetchone()
+    if still_used:
+        return 0
+
+    rows = conn.execute("""
+        SELECT b.id, b.top1, b.top2, b.top3, b.tabs_json
+        FROM build_module_usage u
+        JOIN builds b ON b.id = u.build_id
+        WHERE u.weapon_type = ? AND u.module_en = ?
+    """, (weapon_type, old_key)).fetchall()
+
+    def swap(value):
+        return new_en if _norm_module_key(value) == old_key else value
+
+    updates = []
+    for build_id, top1, top2, top3, tabs_json in rows:
+        tops = [swap(top1), swap(top2), swap(top3)]
+        try:
+            tabs = json.loads(tabs_json or "[]")
+        except Exception:
+            tabs = []
+        for tab in tabs:
+            if isinstance(tab, dict) and isinstance(tab.get("items"), list):
+                tab["items"] = [swap(i) for i in tab["items"]]
+        new_tabs_json = json.dumps(tabs, ensure_ascii=False)
+        if tops != [top1, top2, top3] or new_tabs_json != tabs_json:
+            updates.append((*tops, new_tabs_json, build_id))
+
+    if updates:
+        conn.executemany("UPDATE builds SET top1 = ?, top2 = ?, top3 = ?, tabs_json = ? WHERE id = ?", updates)
+        for u in updates:
+            _log_build_change(conn, u[-1], "upsert")
+    # OR REPLACE: если сборка уже ссылалась и на новый ключ, строка просто схлопнется
+    conn.execute(
+        "UPDATE OR REPLACE build_module_usage SET module_en = ? WHERE weapon_type = ? AND module_en = ?",
+        (_norm_module_key(new_en), weapon_type, old_key)
+    )
+    return len(updates)
+
+@_writes
+def modules_patch_many(patches: list[dict]) -> int:
+    """
+    Пакетная правка модулей [{id, pos?, category?, ru?}] одной транзакцией
+    (перестановка drag-and-drop и т.п.). Отсутствующие поля не меняются.
+    Ошибка в любом патче (например, конфликт wm_unique) откатывает весь пакет.
+    Возвращает число обновлённых строк.
+    """
+    rows = []
+    for p in patches:
+        category = p.get("category")
+        ru = p.get("ru")
+        pos = p.get("pos")
+        for field, value in (("category", category), ("ru", ru)):
+            if value is not None and not isinstance(value, str):
+                raise ValueError(f"Поле {field} должно быть строкой (id={p.get('id')})")
+        rows.append((
+            category.strip() if category is not None else None,
+            ru.strip() if ru is not None else None,
+            int(pos) if pos is not None else None,
+            int(p["id"]),
+        ))
+    if not rows:
+        return 0
+
+    with get_conn() as conn:
+        ids = [r[3] for r in rows]
+        current = {}  # id -> (weapon_type, category) до правки
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            current.update((r[0], (r[1], r[2])) for r in conn.execute(
+                f"SELECT id, weapon_type, category FROM weapon_modules WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ))
+        types = {weapon_type for weapon_type, _ in current.values()}
+        # build_module_usage зависит только от категорий: перестановка pos его не трогает
+        recategorized = {
+            current[r[3]][0] for r in rows
+            if r[0] is not None and r[3] in current and r[0] != current[r[3]][1]
+        }
+        cur = conn.executemany("""
+            UPDATE weapon_modules
+            SET category = COALESCE(?, category), ru = COALESCE(?, ru), pos = COALESCE(?, pos)
+            WHERE id = ?
+        """, rows)
+        if recategorized:
+            _refresh_usage_categories(conn, recategorized)
+    if types:
+        invalidate_modules_cache(*types)
+    return cur.rowcount
+
+class ModuleInUseError(ValueError):
+    """Модуль (или категория модулей) ещё используется в сборках."""
+
+    def __init__(self, builds: int):
+        super().__init__(f"Модуль используется в сборках: {builds}")
+        self.builds = builds
 
-def module_delete(module_id: int) -> int:
+_USAGE_OF_MODULES = """
+    SELECT COUNT(DISTINCT u.build_id)
+    FROM weapon_modules wm
+    JOIN build_module_usage u ON u.weapon_type = wm.weapon_type AND u.module_en = wm.en
+"""
+
+@_writes
+def module_delete(module_id: int, force: bool = False) -> int:
+    """
+    Удалить модуль. Если на него ссылаются сборки и force=False — ModuleInUseError.
+    """
     with get_conn() as conn:
+        row = conn.execute("SELECT weapon_type FROM weapon_modules WHERE id = ?", (module_id,)).fetchone()
+        if not row:
+            return 0
+        if not force:
+            used = conn.execute(f"{_USAGE_OF_MODULES} WHERE wm.id = ?", (module_id,)).fetchone()[0]
+            if used:
+                raise ModuleInUseError(used)
         cur = conn.execute("DELETE FROM weapon_modules WHERE id = ?", (module_id,))
-        return cur.rowcount
+        _refresh_usage_categories(conn, [row[0]])
+    invalidate_modules_cache(row[0])
+    return cur.rowcount
+
+@_writes
+def modules_delete_category(weapon_type: str, category: str, force: bool = False) -> int:
+    """
+    Удалить все модули категории для weapon_type. Возвращает число удалённых.
+    Если модули категории используются в сборках и force=False — ModuleInUseError.
+    """
+    with get_conn() as conn:
+        if not force:
+            used = conn.execute(
+                f"{_USAGE_OF_MODULES} WHERE wm.weapon_type = ? AND wm.category = ?", (weapon_type, category)
+            ).fetchone()[0]
+            if used:
+                raise ModuleInUseError(used)
+        cur = conn.execute(
+            "DELETE FROM weapon_modules WHERE weapon_type = ? AND category = ?", (weapon_type, category)
+        )
+        if cur.rowcount:
+            _refresh_usage_categories(conn, [weapon_type])
+    if cur.rowcount:
+        invalidate_modules_cache(weapon_type)
+    return cur.rowcount
+
+def module_usage(module_id: int) -> dict | None:
+    """
+    Сборки, в которых используется модуль (по индексу build_module_usage):
+    {"module": {...}, "builds": [{id, title, weapon_type, date}]}. None — модуля нет.
+    """
+    with get_conn(row_mode=True) as conn:
+        module = conn.execute(
+            "SELECT id, weapon_type, category, en, ru, pos FROM weapon_modules WHERE id = ?", (module_id,)
+        ).fetchone()
+        if not module:
+            return None
+        rows = conn.execute(f"""
+            SELECT b.id, b.title, b.weapon_type, b.date
+            FROM build_module_usage u
+            JOIN builds b ON b.id = u.build_id
+            WHERE u.weapon_type = ? AND u.module_en = ?
+            {BUILDS_ORDER}
+        """, (module["weapon_type"], module["en"])).fetchall()
+    return {"module": dict(module), "builds": [dict(r) for r in rows]}
+
+def modules_usage_counts(weapon_type: str) -> dict:
+    """{module_id: число сборок} для модулей weapon_type, которые где-то используются."""
+    with get_conn() as conn:
+        rows = conn.execute("""
+            SELECT wm.id, COUNT(u.build_id)
+            FROM weapon_modules wm
+            JOIN build_module_usage u ON u.weapon_type = wm.weapon_type AND u.module_en = wm.en
+            WHERE wm.weapon_type = ?
+            GROUP BY wm.id
+        """, (weapon_type,)).fetchall()
+    return dict(rows)
+
+@_writes
+def modules_sync(seed: dict, prune: bool = False) -> dict:
+    """
+    Привести weapon_modules к эталону {weapon_type: {category: [{en, ru}, ...]}} (pos = индекс в списке).
+    Пишутся только отличия — INSERT/UPDATE/DELETE через executemany в одной транзакции.
+    prune=True — ещё и удалить модули, которых нет в эталоне (например, добавленные админом),
+    кроме тех, на которые ссылаются сборки и которых после синхронизации не останется
+    ни в одной категории типа: они попадают в kept_in_use. Трогаются только типы из эталона.
+    Возвращает счётчики и тайминги (мс).
+    """
+    t0 = time.perf_counter()
+    wanted = {}
+    for weapon_type, categories in seed.items():
+        weapon_type = (weapon_type or "").strip()
+        for category, items in (categories or {}).items():
+            category = (category or "").strip()
+            for pos, item in enumerate(items or []):
+                en_key = (item.get("en") or "").strip().lower()
+                if weapon_type and category and en_key:
+                    wanted.setdefault((weapon_type, category, en_key), ((item.get("ru") or "").strip(), pos))
+
+    types = sorted({k[0] for k in wanted})
+    inserts, updates, deletes = [], [], []
+    kept_in_use = []
+    changed_types = set()
+
+    with get_conn() as conn:
+        existing = {}
+        if types:
+            marks = ",".join("?" * len(types))
+            for row in conn.execute(
+                f"SELECT id, weapon_type, category, en, ru, pos FROM weapon_modules WHERE weapon_type IN ({marks})",
+                types,
+            ):
+                existing[(row[1], row[2], row[3])] = (row[0], row[4], row[5])
+        t1 = time.perf_counter()
+
+        for key, (ru, pos) in wanted.items():
+            current = existing.get(key)
+            if current is None:
+                inserts.append((*key, ru, pos))
+                changed_types.add(key[0])
+            elif (current[1], current[2]) != (ru, pos):
+                updates.append((ru, pos, current[0]))
+                changed_types.add(key[0])
+        if prune:
+            stale = {key: module_id for key, (module_id, _, _) in existing.items() if key not in wanted}
+            usage = {}
+            if stale:
+                # Как _USAGE_OF_MODULES в module_delete, но одним запросом на все типы эталона
+                usage = {
+                    (r[0], r[1]): r[2] for r in conn.execute(f"""
+                        SELECT weapon_type, module_en, COUNT(DISTINCT build_id) FROM build_module_usage
+                        WHERE weapon_type IN ({marks}) GROUP BY weapon_type, module_en
+                    """, types)
+                }
+            # Сборка ссылается на (тип, en): строка в другой категории по-прежнему её закрывает
+            remaining = {(key[0], key[2]) for key in wanted}
+            remaining.update((key[0], key[2]) for key in existing if key not in stale)
+            for key, module_id in stale.items():
+                builds = usage.get((key[0], key[2]), 0)
+                if builds and (key[0], key[2]) not in remaining:
+                    kept_in_use.append({"id": module_id, "weapon_type": key[0], "category": key[1],
+                                        "en": key[2], "builds": builds})
+                    continue
+                deletes.append((module_id,))
+                changed_types.add(key[0])
+        t2 = time.perf_counter()
+
+        if deletes:
+            conn.executemany("DELETE FROM weapon_modules WHERE id = ?", deletes)
+        if updates:
+            conn.executemany("UPDATE weapon_modules SET ru = ?, pos = ? WHERE id = ?", updates)
+        if inserts:
+            conn.executemany(
+                "INSERT INTO weapon_modules(weapon_type, category, en, ru, pos) VALUES (?,?,?,?,?)", inserts
+            )
+        if changed_types:
+            _refresh_usage_categories(conn, changed_types)
+    t3 = time.perf_counter()
+
+    if changed_types:
+        invalidate_modules_cache(*changed_types)
+    return {
+        "types": types,
+        "total": len(wanted),
+        "inserted": len(inserts),
+        "updated": len(updates),
+        "deleted": len(deletes),
+        "kept_in_use": kept_in_use,
+        "timings_ms": {
+            "read": round((t1 - t0) * 1000, 2),
+            "diff": round((t2 - t1) * 1000, 2),
+            "write": round((t3 - t2) * 1000, 2),
+            "total": round((t3 - t0) * 1000, 2),
+        },
+    }
 
 # ====== ВЕРСИИ ======
 
+@_writes
 def add_version_entry(content: str):
     with get_conn() as conn:
         conn.execute("""
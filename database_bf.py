@@ -1,8 +1,8 @@
 import sqlite3
 import json
 from pathlib import Path
-from contextlib import contextmanager
-from datetime import datetime
+
+import storage
 
 
 
@@ -13,18 +13,8 @@ BF_DB_PATH = Path("/opt/ndloadouts_storage/bf_challenges.db")
 BF_DB_PATH.parent.mkdir(exist_ok=True)
 
 
-@contextmanager
 def get_bf_conn(row_mode: bool = False):
-    conn = sqlite3.connect(BF_DB_PATH)
-    if row_mode:
-        conn.row_factory = sqlite3.Row
-    try:
-        conn.execute("PRAGMA foreign_keys = ON")
-        conn.execute("PRAGMA journal_mode = WAL")
-        yield conn
-        conn.commit()
-    finally:
-        conn.close()
+    return storage.connection(BF_DB_PATH, row_mode)
 
 
 def init_bf_db():
@@ -205,9 +195,8 @@ def get_challenge_goal(challenge_id: int) -> int:
 DB_PATH = Path("/opt/ndloadouts/builds_bf.db")
 
 def get_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Соединение из пула: with коммитит (или откатывает) и возвращает его в пул
+    return storage.connection(DB_PATH, row_mode=True)
 
 def init_bf_builds_table():
     with get_connection() as conn:
@@ -244,6 +233,24 @@ def init_bf_builds_table():
             UNIQUE (weapon_type, category, en)
         )
         """)
+
+        # Обратный индекс «модуль → сборки»; поддерживается CRUD BF-сборок
+        usage_exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'bf_build_module_usage'"
+        ).fetchone()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS bf_build_module_usage (
+            build_id INTEGER NOT NULL,
+            weapon_type TEXT,
+            module_en TEXT NOT NULL,
+            PRIMARY KEY (build_id, module_en)
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS bf_bmu_module_idx ON bf_build_module_usage(module_en, weapon_type)")
+        if not usage_exists:
+            for r in conn.execute("SELECT * FROM bf_builds").fetchall():
+                b = _bf_build_from_row(r)
+                _index_bf_build_modules(conn, b["id"], b.get("weapon_type"), b)
         conn.commit()
 
 
@@ -309,52 +316,182 @@ def add_bf_module(data):
         conn.commit()
 
 
-def delete_bf_module(module_id):
+def update_bf_module(module_id, data) -> dict:
+    """
+    Правка модуля BF (category / en / pos). Новый en переносится в bf_builds того же типа
+    (для общих модулей 'shv' — во все сборки) в той же транзакции.
+    Возвращает {"updated": строк модуля, "builds": затронутых сборок}.
+    """
     with get_connection() as conn:
-        conn.execute("DELETE FROM bf_modules WHERE id = ?", (module_id,))
+        row = conn.execute("SELECT weapon_type, category, en, pos FROM bf_modules WHERE id = ?",
+                           (module_id,)).fetchone()
+        if not row:
+            return {"updated": 0, "builds": 0}
+        new_en = (data.get("en") or row["en"]).strip()
+        conn.execute(
+            "UPDATE bf_modules SET category = ?, en = ?, pos = ? WHERE id = ?",
+            (data.get("category") or row["category"], new_en, int(data.get("pos", row["pos"]) or 0), module_id)
+        )
+        touched = 0
+        if new_en != row["en"]:
+            touched = _propagate_bf_module_rename(conn, row["weapon_type"], row["en"], new_en)
         conn.commit()
+    return {"updated": 1, "builds": touched}
+
+def _propagate_bf_module_rename(conn, weapon_type: str, old_en: str, new_en: str) -> int:
+    # Кандидатов даёт bf_build_module_usage. Если старый en ещё есть у другого модуля — не трогаем.
+    if weapon_type == "shv":
+        still_used = conn.execute("SELECT 1 FROM bf_modules WHERE en = ? LIMIT 1", (old_en,)).fetchone()
+        scope, params = "", (old_en,)
+    else:
+        still_used = conn.execute(
+            "SELECT 1 FROM bf_modules WHERE en = ? AND weapon_type IN (?, 'shv') LIMIT 1", (old_en, weapon_type)
+        ).fetchone()
+        scope, params = "AND u.weapon_type = ?", (old_en, weapon_type)
+    if still_used:
+        return 0
+    rows = conn.execute(
+        f"SELECT b.* FROM bf_build_module_usage u JOIN bf_builds b ON b.id = u.build_id "
+        f"WHERE u.module_en = ? {scope}", params
+    ).fetchall()
+
+    updates = []
+    for r in rows:
+        b = _bf_build_from_row(r)
+        tops = [new_en if b.get(t) == old_en else b.get(t) for t in ("top1", "top2", "top3")]
+        tabs = b["tabs"] if isinstance(b["tabs"], list) else []
+        changed = tops != [b.get("top1"), b.get("top2"), b.get("top3")]
+        for tab in tabs:
+            if isinstance(tab, dict) and isinstance(tab.get("items"), list) and old_en in tab["items"]:
+                tab["items"] = [new_en if i == old_en else i for i in tab["items"]]
+                changed = True
+        if changed:
+            updates.append((*tops, json.dumps(tabs, ensure_ascii=False), b["id"]))
+
+    if updates:
+        conn.executemany("UPDATE bf_builds SET top1 = ?, top2 = ?, top3 = ?, tabs = ? WHERE id = ?", updates)
+        conn.executemany(
+            "UPDATE OR REPLACE bf_build_module_usage SET module_en = ? WHERE build_id = ? AND module_en = ?",
+            [(new_en, u[-1], old_en) for u in updates]
+        )
+    return len(updates)
+
+
+def _bf_build_module_keys(build) -> list[str]:
+    keys = [build.get("top1"), build.get("top2"), build.get("top3")]
+    tabs = build.get("tabs") if isinstance(build.get("tabs"), list) else []
+    for tab in tabs:
+        if isinstance(tab, dict) and isinstance(tab.get("items"), list):
+            keys.extend(tab["items"])
+    return list(dict.fromkeys(k.strip() for k in keys if isinstance(k, str) and k.strip()))
+
+def _index_bf_build_modules(conn, build_id, weapon_type, build):
+    conn.execute("DELETE FROM bf_build_module_usage WHERE build_id = ?", (build_id,))
+    conn.executemany(
+        "INSERT OR IGNORE INTO bf_build_module_usage (build_id, weapon_type, module_en) VALUES (?, ?, ?)",
+        [(build_id, weapon_type, key) for key in _bf_build_module_keys(build)]
+    )
+
+# Модули 'shv' общие: ими пользуются сборки любого типа
+_BF_MODULE_USAGE = """
+    FROM bf_modules m
+    JOIN bf_build_module_usage u ON u.module_en = m.en AND (m.weapon_type = 'shv' OR u.weapon_type = m.weapon_type)
+"""
+
+def get_bf_module_usage(module_id) -> list[int] | None:
+    """id BF-сборок, где используется модуль; None — модуля нет."""
+    with get_connection() as conn:
+        if not conn.execute("SELECT 1 FROM bf_modules WHERE id = ?", (module_id,)).fetchone():
+            return None
+        rows = conn.execute(
+            f"SELECT DISTINCT u.build_id {_BF_MODULE_USAGE} WHERE m.id = ? ORDER BY u.build_id DESC", (module_id,)
+        ).fetchall()
+    return [r[0] for r in rows]
+
+def get_bf_modules_usage_counts(weapon_type) -> dict:
+    """{module_id: число сборок} для модулей типа (включая общие 'shv')."""
+    with get_connection() as conn:
+        rows = conn.execute(
+            f"SELECT m.id, COUNT(DISTINCT u.build_id) {_BF_MODULE_USAGE} "
+            f"WHERE m.weapon_type IN (?, 'shv') AND (m.weapon_type = ? OR u.weapon_type = ?) GROUP BY m.id",
+            (weapon_type, weapon_type, weapon_type)
+        ).fetchall()
+    return {r[0]: r[1] for r in rows}
+
+def delete_bf_module(module_id, force: bool = False) -> int:
+    """
+    Удалить модуль BF. Если он используется в сборках и force=False — ValueError
+    (число сборок в тексте), модуль остаётся.
+    """
+    with get_connection() as conn:
+        if not force:
+            used = conn.execute(
+                f"SELECT COUNT(DISTINCT u.build_id) {_BF_MODULE_USAGE} WHERE m.id = ?", (module_id,)
+            ).fetchone()[0]
+            if used:
+                raise ValueError(f"Модуль используется в сборках: {used}")
+        cur = conn.execute("DELETE FROM bf_modules WHERE id = ?", (module_id,))
+        conn.commit()
+    return cur.rowcount
 
-import json
+def _bf_build_from_row(r) -> dict:
+    b = dict(r)
+
+    # --- categories ---
+    try:
+        if isinstance(b["categories"], str):
+            b["categories"] = json.loads(b["categories"])
+    except Exception:
+        try:
+            b["categories"] = eval(b["categories"])
+        except Exception:
+            b["categories"] = []
+
+    # --- tabs ---
+    try:
+        if isinstance(b["tabs"], str):
+            b["tabs"] = json.loads(b["tabs"])
+            # иногда items внутри вкладок тоже как строка
+            for t in b["tabs"]:
+                if isinstance(t.get("items"), str):
+                    t["items"] = json.loads(t["items"])
+    except Exception:
+        try:
+            b["tabs"] = eval(b["tabs"])
+        except Exception:
+            b["tabs"] = []
+
+    return b
 
 def get_all_bf_builds():
     with get_connection() as conn:
         rows = conn.execute("SELECT * FROM bf_builds ORDER BY id DESC").fetchall()
-        builds = []
-        for r in rows:
-            b = dict(r)
-
-            # --- categories ---
-            try:
-                if isinstance(b["categories"], str):
-                    b["categories"] = json.loads(b["categories"])
-            except Exception:
-                try:
-                    b["categories"] = eval(b["categories"])
-                except Exception:
-                    b["categories"] = []
-
-            # --- tabs ---
-            try:
-                if isinstance(b["tabs"], str):
-                    b["tabs"] = json.loads(b["tabs"])
-                    # иногда items внутри вкладок тоже как строка
-                    for t in b["tabs"]:
-                        if isinstance(t.get("items"), str):
-                            t["items"] = json.loads(t["items"])
-            except Exception:
-                try:
-                    b["tabs"] = eval(b["tabs"])
-                except Exception:
-                    b["tabs"] = []
-
-            builds.append(b)
-        return builds
+        return [_bf_build_from_row(r) for r in rows]
+
+def iter_bf_builds(mode: str = "all"):
+    """
+    BF-сборки по одной прямо из курсора — для потоковой отдачи без полного списка в памяти.
+    Соединение берётся из пула без привязки к потоку: StreamingResponse дёргает генератор
+    из разных потоков, поэтому вернуть его надо в finally, а не по выходу из with.
+    """
+    pool = storage.get_pool(DB_PATH)
+    conn = pool.acquire()
+    conn.row_factory = sqlite3.Row
+    try:
+        if mode == "all":
+            cur = conn.execute("SELECT * FROM bf_builds ORDER BY id DESC")
+        else:
+            cur = conn.execute("SELECT * FROM bf_builds WHERE mode = ? ORDER BY id DESC", (mode,))
+        for r in cur:
+            yield _bf_build_from_row(r)
+    finally:
+        pool.release(conn)
 
 
 
 def add_bf_build(data):
     with get_connection() as conn:
-        conn.execute("""
+        cur = conn.execute("""
             INSERT INTO bf_builds (title, weapon_type, top1, top2, top3, date, tabs, categories, mode)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (
@@ -368,11 +505,12 @@ def add_bf_build(data):
             str(data.get("categories")),
             data.get("mode", "mp")  # ✅ default mp
         ))
+        _index_bf_build_modules(conn, cur.lastrowid, data.get("weapon_type"), data)
         conn.commit()
 
 def update_bf_build(build_id, data):
     with get_connection() as conn:
-        conn.execute("""
+        cur = conn.execute("""
             UPDATE bf_builds
             SET title=?, weapon_type=?, top1=?, top2=?, top3=?, date=?, tabs=?, categories=?, mode=?
             WHERE id=?
@@ -388,11 +526,14 @@ def update_bf_build(build_id, data):
             data.get("mode", "mp"),  # ✅ сохраняем режим
             build_id
         ))
+        if cur.rowcount:
+            _index_bf_build_modules(conn, build_id, data.get("weapon_type"), data)
         conn.commit()
 
 def delete_bf_build(build_id):
     with get_connection() as conn:
         conn.execute("DELETE FROM bf_builds WHERE id = ?", (build_id,))
+        conn.execute("DELETE FROM bf_build_module_usage WHERE build_id = ?", (build_id,))
         conn.commit()
 
 
@@ -0,0 +1,53 @@
+import sys
+import json
+from pathlib import Path
+from database import init_db, modules_sync
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+FILE_PREFIX = "modules-"
+TYPES_FILE = "types.json"  # типы оружия Warzone; остальные файлы (modules-shv.json — общие модули BF) не наши
+
+
+def load_modules_seed(data_dir: Path = DATA_DIR) -> dict:
+    """
+    Читает data/modules-<type>.json ({category: [{ru, en}]}) в {type: {category: [...]}}.
+    Тип оружия берётся из имени файла; файлы типов, которых нет в data/types.json, пропускаются.
+    Элемент-строка — это en без перевода.
+    """
+    with open(data_dir / TYPES_FILE, "r", encoding="utf-8") as f:
+        known_types = {t["key"] for t in json.load(f)}
+
+    seed = {}
+    for path in sorted(data_dir.glob(f"{FILE_PREFIX}*.json")):
+        weapon_type = path.stem[len(FILE_PREFIX):]
+        if weapon_type not in known_types:
+            print(f"⚠️ {path.name}: типа {weapon_type!r} нет в {TYPES_FILE}, пропускаем")
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        seed[weapon_type] = {
+            category: [{"en": item, "ru": item} if isinstance(item, str) else item for item in items]
+            for category, items in data.items()
+        }
+    if not seed:
+        raise FileNotFoundError(f"❌ Не найдены файлы {FILE_PREFIX}*.json в {data_dir.resolve()}")
+    return seed
+
+
+def import_modules(prune: bool = False) -> dict:
+    init_db()
+    report = modules_sync(load_modules_seed(), prune=prune)
+    t = report["timings_ms"]
+    print(f"✅ Модули ({', '.join(report['types'])}): всего {report['total']}, "
+          f"+{report['inserted']} ~{report['updated']} -{report['deleted']} "
+          f"за {t['total']} мс (чтение {t['read']}, дифф {t['diff']}, запись {t['write']})")
+    for m in report["kept_in_use"]:
+        print(f"⚠️ Не удалён {m['weapon_type']}/{m['category']}/{m['en']} (id={m['id']}): "
+              f"используется в сборках: {m['builds']}")
+    return report
+
+
+if __name__ == "__main__":
+    # --prune: удалить модули, которых нет в файлах (например, добавленные вручную).
+    # Модули, на которые ссылаются сборки, не удаляются и в любом случае.
+    import_modules(prune="--prune" in sys.argv[1:])
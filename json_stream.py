@@ -0,0 +1,47 @@
+import json
+from typing import Iterable, Iterator
+
+# =====================================================
+# Потоковая JSON-сериализация для больших списков.
+# Отдаём массив по кусочкам (StreamingResponse), не собирая в памяти
+# ни полный список dict'ов, ни итоговую строку.
+# =====================================================
+
+CHUNK_ITEMS = 64  # столько элементов склеиваем в один кусок ответа
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def iter_json_array(items: Iterable, chunk_items: int = CHUNK_ITEMS) -> Iterator[str]:
+    """
+    Кодирует итерируемое (курсор, генератор, список) как JSON-массив по частям.
+    """
+    yield "["
+    buf = []
+    first = True
+    for item in items:
+        buf.append(_dumps(item) if first else "," + _dumps(item))
+        first = False
+        if len(buf) >= chunk_items:
+            yield "".join(buf)
+            buf.clear()
+    if buf:
+        yield "".join(buf)
+    yield "]"
+
+
+def iter_json_object(fields: dict) -> Iterator[str]:
+    """
+    Кодирует dict как JSON-объект; значения-итераторы (генераторы, курсоры)
+    стримятся как массивы через iter_json_array, остальное — json.dumps целиком.
+    """
+    yield "{"
+    for i, (key, value) in enumerate(fields.items()):
+        yield ("," if i else "") + _dumps(str(key)) + ":"
+        if isinstance(value, Iterator):
+            yield from iter_json_array(value)
+        else:
+            yield _dumps(value)
+    yield "}"
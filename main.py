@@ -18,7 +18,7 @@ from pathlib import Path
 from typing import List
 from urllib.parse import parse_qs, unquote
 from datetime import datetime, timezone, timedelta
-import requests
+import httpx
 from dotenv import load_dotenv, set_key, dotenv_values
 
 # -------------------------------
@@ -29,7 +29,7 @@ from fastapi import (
     HTTPException, Query, APIRouter
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
@@ -37,9 +37,13 @@ from fastapi.templating import Jinja2Templates
 # 📦 LOCAL MODULES (Warzone DB / Versions DB)
 # -------------------------------
 from database import (
-    init_db, get_all_builds, add_build, delete_build_by_id, get_all_users,
-    save_user, update_build_by_id, modules_grouped_by_category,
-    module_add_or_update, module_update, module_delete,
+    init_db, get_builds_cached, add_build, delete_build_by_id, get_users,
+    save_user, update_build_by_id, modules_grouped_cached, modules_cache_version,
+    localize_builds, compact_builds, get_build_changes, get_build_by_id, builds_cache_version,
+    module_add_or_update, module_update, module_delete, modules_delete_category, modules_snapshot,
+    modules_suggest, modules_sync, modules_patch_many,
+    module_usage, modules_usage_counts, ModuleInUseError,
+    get_exclusive_categories, add_exclusive_category, delete_exclusive_category,
 )
 
 # -------------------------------
@@ -47,7 +51,7 @@ from database import (
 # -------------------------------
 from database_bf import (
     init_bf_builds_table,
-    get_all_bf_builds,
+    iter_bf_builds,
     add_bf_build,
     update_bf_build,
     delete_bf_build,
@@ -56,7 +60,10 @@ from database_bf import (
     delete_bf_weapon_type,
     get_bf_modules_by_type,
     add_bf_module,
+    update_bf_module,
     delete_bf_module,
+    get_bf_module_usage,
+    get_bf_modules_usage_counts,
     init_bf_db, get_bf_conn,
     get_all_categories, add_category, delete_category,
     add_challenge, update_challenge, delete_challenge
@@ -75,6 +82,13 @@ from database_versions import (
 
 from fastapi import Depends
 
+from json_stream import iter_json_array, iter_json_object
+import storage
+from storage import run_db
+from response_cache import response_cache
+from analytics_buffer import AnalyticsBuffer, ROLLUPS, init_analytics_schema, event_error
+from import_modules import load_modules_seed
+
 # =====================================================
 # 🌍 GLOBAL CONFIG
 # =====================================================
@@ -146,6 +160,23 @@ def ensure_admin_from_init(init_data_str: str):
     return uid
 
 
+def cached_json(request: Request, endpoint: str, key, build, version=None, ttl: float | None = None):
+    """
+    JSON-ответ из response_cache: готовые байты под Accept-Encoding клиента
+    (br/gzip/identity), ETag и 304 при совпадении If-None-Match.
+    build() вызывается только при промахе кэша.
+    """
+    body = response_cache.get(endpoint, key, build, version, ttl)
+    headers = {"ETag": body.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == body.etag:
+        return Response(status_code=304, headers=headers)
+
+    encoding, content = body.pick(request.headers.get("accept-encoding", ""))
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
 def prettify_time(ts: str):
     """
     Форматирует ISO-дату в dd.mm.yyyy HH:MM:SS (Europe/Moscow, UTC+3).
@@ -167,41 +198,9 @@ def init_analytics_db():
     """
     try:
         ANALYTICS_DB.parent.mkdir(parents=True, exist_ok=True)
-        conn = sqlite3.connect(ANALYTICS_DB)
-        cur = conn.cursor()
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS analytics (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT,
-            action TEXT,
-            details TEXT,
-            timestamp TEXT
-        )""")
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS errors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT,
-            error TEXT,
-            details TEXT,
-            timestamp TEXT
-        )""")
+        with storage.connection(ANALYTICS_DB) as conn:
+            init_analytics_schema(conn)
 
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS user_profiles (
-            user_id TEXT PRIMARY KEY,
-            first_name TEXT,
-            username TEXT,
-            last_seen TEXT,
-            platform TEXT,
-            total_actions INTEGER DEFAULT 0,
-            first_seen TEXT,
-            last_action TEXT
-        )""")
-
-        conn.commit()
-        conn.close()
         print("✅ Analytics DB initialized")
     except Exception as e:
         print(f"❌ Analytics DB error: {e}")
@@ -226,6 +225,75 @@ def startup_all():
     except Exception as e:
         print(f"⚠️ Startup init error: {e}")
 
+
+async def optimize_sqlite_periodically():
+    """
+    PRAGMA optimize по всем БД раз в storage.OPTIMIZE_INTERVAL секунд (в потоке, не в event loop).
+    """
+    while True:
+        await asyncio.sleep(storage.OPTIMIZE_INTERVAL)
+        await asyncio.to_thread(storage.optimize_all)
+
+
+LOOP_LAG_INTERVAL = 0.5  # секунды между замерами задержки event loop
+LOOP_LAG_STALL_MS = 100  # задержка больше этой считается «залипанием» (блокирующий вызов в async-коде)
+loop_lag = {"samples": 0, "last_ms": 0.0, "avg_ms": 0.0, "max_ms": 0.0, "stalls": 0}
+
+
+async def monitor_loop_lag():
+    """
+    Засыпаем на LOOP_LAG_INTERVAL и смотрим, насколько позже проснулись:
+    опоздание — время, которое event loop был занят чужим синхронным кодом.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag_ms = max(0.0, (loop.time() - started - LOOP_LAG_INTERVAL) * 1000)
+        loop_lag["samples"] += 1
+        loop_lag["last_ms"] = round(lag_ms, 2)
+        # Скользящее среднее: последние ~минуту замеров
+        loop_lag["avg_ms"] = round(loop_lag["avg_ms"] + (lag_ms - loop_lag["avg_ms"]) / min(loop_lag["samples"], 120), 2)
+        loop_lag["max_ms"] = max(loop_lag["max_ms"], round(lag_ms, 2))
+        if lag_ms > LOOP_LAG_STALL_MS:
+            loop_lag["stalls"] += 1
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    analytics_buffer.start()
+    app.state.loop_lag_task = asyncio.create_task(monitor_loop_lag())
+    if storage.OPTIMIZE_INTERVAL > 0:
+        app.state.optimize_task = asyncio.create_task(optimize_sqlite_periodically())
+
+
+@app.on_event("shutdown")
+def shutdown_all():
+    """
+    Дописать буфер аналитики, дождаться вызовов run_db и закрыть соединения пулов SQLite
+    (перед закрытием — PRAGMA optimize).
+    """
+    for name in ("optimize_task", "loop_lag_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    # Сначала дописываем буфер аналитики — ему ещё нужны очередь записи и пул
+    analytics_buffer.stop()
+    storage.close_all()
+
+
+@app.get("/api/metrics")
+def api_metrics():
+    """
+    Счётчики пулов соединений SQLite (по файлам БД), их профиль, очереди записи, пул потоков run_db,
+    буфер аналитики, задержка event loop и кэш готовых ответов.
+    """
+    return {"sqlite": storage.pool_stats(), "sqlite_profile": storage.profile(),
+            "sqlite_writers": storage.writer_stats(),
+            "db_executor": storage.executor_stats(), "analytics_buffer": analytics_buffer.stats(),
+            "event_loop_lag": loop_lag,
+            "response_cache": response_cache.stats()}
+
 # =====================================================
 # 🏠 ROOT + GITHUB WEBHOOK
 # =====================================================
@@ -257,12 +325,56 @@ async def webhook(request: Request, background_tasks: BackgroundTasks):
 # =====================================================
 # ⚔️ WARZONE — MODULES DICT API
 # =====================================================
+@app.get("/api/modules/all")
+def api_modules_all(request: Request):
+    """
+    Весь справочник модулей одним документом: {"revision": N, "types": {weapon_type: {category: [...]}}}.
+    Собирается из скомпилированного снимка; ETag меняется с каждой правкой модуля.
+    """
+    revision, snapshot = modules_snapshot()
+    return cached_json(request, "modules_all", None,
+                       lambda: {"revision": revision, "types": snapshot}, version=revision)
+
+
+@app.get("/api/modules/suggest")
+def api_modules_suggest(
+    q: str = Query("", max_length=64),
+    weapon_type: str | None = Query(None, alias="type"),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """
+    Подсказки модулей для поля ввода: совпадение с началом слова в en/ru,
+    без учёта регистра и ё/е. Ищет по индексу в памяти, в БД не ходит.
+    """
+    revision, items = modules_suggest(q, weapon_type, limit)
+    return {"revision": revision, "items": items}
+
+
 @app.get("/api/modules/{weapon_type}")
 def api_modules_list(weapon_type: str):
     """
     Получить словарь модулей по типу оружия, сгруппированный по категориям.
     """
-    return modules_grouped_by_category(weapon_type)
+    return modules_grouped_cached(weapon_type)
+
+
+@app.get("/api/modules/{module_id:int}/builds")
+def api_module_builds(module_id: int):
+    """
+    Сборки, в которых используется модуль (обратный индекс, без разбора tabs_json).
+    """
+    usage = module_usage(module_id)
+    if usage is None:
+        raise HTTPException(status_code=404, detail="Модуль не найден")
+    return usage
+
+
+@app.get("/api/modules/{weapon_type}/usage")
+def api_modules_usage(weapon_type: str):
+    """
+    Счётчики использования модулей типа для редактора: {"counts": {module_id: builds}}.
+    """
+    return {"counts": modules_usage_counts(weapon_type)}
 
 
 @app.post("/api/modules")
@@ -271,7 +383,8 @@ async def api_modules_add(payload: dict = Body(...)):
     Добавление или обновление конкретного модуля (только админы).
     """
     ensure_admin_from_init(payload.get("initData", ""))
-    module_add_or_update(
+    await run_db(
+        module_add_or_update,
         weapon_type=payload["weapon_type"],
         category=payload["category"],
         en=payload["en"],
@@ -281,29 +394,72 @@ async def api_modules_add(payload: dict = Body(...)):
     return {"status": "ok"}
 
 
+@app.post("/api/modules/seed")
+async def api_modules_seed(payload: dict = Body(...)):
+    """
+    Синхронизация словаря модулей с data/modules-*.json (только админы).
+    Пишутся только отличия; prune=true — ещё и удалить модули, которых нет в файлах
+    (кроме используемых в сборках — они перечислены в kept_in_use).
+    """
+    ensure_admin_from_init(payload.get("initData", ""))
+    try:
+        seed = await run_db(load_modules_seed)
+        return await run_db(modules_sync, seed, prune=bool(payload.get("prune", False)))
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.post("/api/modules/batch")
+async def api_modules_batch(payload: dict = Body(...)):
+    """
+    Пакетная правка модулей (только админы): {"initData", "patches": [{id, pos?, category?, ru?}]}.
+    Одна проверка админа, одна транзакция, один сброс кэша — вместо PUT на каждый модуль.
+    """
+    ensure_admin_from_init(payload.get("initData", ""))
+    patches = payload.get("patches")
+    if not isinstance(patches, list) or not all(isinstance(p, dict) and "id" in p for p in patches):
+        raise HTTPException(status_code=400, detail="patches: ожидается список объектов с id")
+    try:
+        updated = await run_db(modules_patch_many, patches)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=409, detail="Модуль с таким en уже есть в этой категории")
+    return {"status": "ok", "updated": updated}
+
+
 @app.put("/api/modules/{module_id}")
 async def api_modules_update(module_id: int, payload: dict = Body(...)):
     """
     Обновление полей модуля (только админы).
+    Новый en сразу переносится в сборки; в ответе — сколько сборок переписано.
     """
     ensure_admin_from_init(payload.get("initData", ""))
-    module_update(
-        module_id,
-        category=payload.get("category"),
-        en=payload.get("en"),
-        ru=payload.get("ru"),
-        pos=payload.get("pos")
-    )
-    return {"status": "ok"}
+    try:
+        result = await run_db(
+            module_update,
+            module_id,
+            category=payload.get("category"),
+            en=payload.get("en"),
+            ru=payload.get("ru"),
+            pos=payload.get("pos")
+        )
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=409, detail="Модуль с таким en уже есть в этой категории")
+    return {"status": "ok", "builds_updated": result["builds"]}
 
 
 @app.delete("/api/modules/{module_id}")
 async def api_modules_delete(module_id: int, payload: dict = Body(...)):
     """
     Удаление модуля по ID (только админы).
+    Модуль, который ещё стоит в сборках, удаляется только с "force": true — иначе 409.
     """
     ensure_admin_from_init(payload.get("initData", ""))
-    module_delete(module_id)
+    try:
+        await run_db(module_delete, module_id, force=bool(payload.get("force")))
+    except ModuleInUseError as e:
+        raise HTTPException(status_code=409, detail={"error": str(e), "builds": e.builds})
     return {"status": "ok"}
 
 
@@ -311,69 +467,132 @@ async def api_modules_delete(module_id: int, payload: dict = Body(...)):
 async def api_modules_delete_category(weapon_type: str, category: str, payload: dict = Body(...)):
     """
     Удаление ВСЕХ модулей категории для weapon_type (только админы).
-    Это оформленный вариант «сырого» блока из исходника.
     """
     ensure_admin_from_init(payload.get("initData", ""))
 
-    conn = sqlite3.connect("/opt/ndloadouts_storage/builds.db")
-    cur = conn.cursor()
-
-    # Проверяем наличие категории
-    cur.execute("""
-        SELECT id FROM modules 
-        WHERE weapon_type = ? AND category = ?
-    """, (weapon_type, category))
-    rows = cur.fetchall()
-
-    if not rows:
-        conn.close()
+    try:
+        deleted = await run_db(modules_delete_category, weapon_type, category, force=bool(payload.get("force")))
+    except ModuleInUseError as e:
+        raise HTTPException(status_code=409, detail={"error": str(e), "builds": e.builds})
+    if not deleted:
         raise HTTPException(status_code=404, detail=f"Категория '{category}' не найдена для типа {weapon_type}")
 
-    # Удаляем все модули этой категории
-    cur.execute("""
-        DELETE FROM modules 
-        WHERE weapon_type = ? AND category = ?
-    """, (weapon_type, category))
-    conn.commit()
-    conn.close()
-
     return {"status": "ok", "message": f"Категория '{category}' удалена"}
 
 # =====================================================
 # ⚔️ WARZONE — BUILDS API
 # =====================================================
 @app.get("/api/builds")
-async def api_builds(category: str = Query("all")):
-    """
-    Получение списка сборок с сортировкой:
+async def api_builds(
+    request: Request,
+    category: str = Query("all"),
+    limit: int | None = Query(None, ge=1, le=200),
+    after: str | None = Query(None),
+    lang: str = Query("en"),
+    view: str = Query("full"),
+    wire: str = Query("json", alias="format"),
+):
+    """
+    Получение списка сборок с сортировкой (делает SQLite по индексу):
     1) top1/top2/top3 приоритет
     2) свежесть даты (по убыванию)
     Фильтрация по категории (если не 'all').
+    Без limit — весь список массивом; с limit — {"builds": [...], "next": курсор},
+    следующая страница: ?limit=...&after=<next>.
+    lang=ru — названия модулей уже переведены на сервере (см. database.localize_builds),
+    словари модулей клиенту не нужны.
+    view=summary — без вкладок (tabs_count вместо tabs); полная сборка: GET /api/builds/{id}.
+    format=compact — модули в top1..3 и tabs[].items заменены id из /api/modules/all
+    (неизвестные остаются строками), lang игнорируется; ответ всегда
+    {"modules_revision": N, "builds": [...], "next": курсор|null}.
+    Ответ — готовые байты из response_cache (пересобираются после записи), ETag/304.
+    """
+    if lang not in ("en", "ru"):
+        return JSONResponse({"error": "Поддерживаются lang=en и lang=ru"}, status_code=400)
+    if view not in ("full", "summary"):
+        return JSONResponse({"error": "Поддерживаются view=full и view=summary"}, status_code=400)
+    if wire not in ("json", "compact"):
+        return JSONResponse({"error": "Поддерживаются format=json и format=compact"}, status_code=400)
+    if wire == "compact":
+        lang = "en"
+
+    def build():
+        _, builds, next_cursor = get_builds_cached(category, limit, after, view == "summary")
+        if wire == "compact":
+            return {"modules_revision": modules_cache_version(), "builds": compact_builds(builds), "next": next_cursor}
+        builds = localize_builds(builds, lang)
+        return builds if limit is None else {"builds": builds, "next": next_cursor}
+
+    # Версия данных: сборки (+ словари модулей, если названия переводим или кодируем в id)
+    uses_modules = lang == "ru" or wire == "compact"
+    version = (builds_cache_version(), modules_cache_version() if uses_modules else None)
+    try:
+        return await run_db(cached_json, request, "builds", (category, limit, after, lang, view, wire), build, version)
+    except ValueError:
+        return JSONResponse({"error": "Некорректный курсор"}, status_code=400)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.get("/api/builds/bundle")
+async def api_builds_bundle(
+    request: Request,
+    category: str = Query("all"),
+    limit: int | None = Query(None, ge=1, le=200),
+    after: str | None = Query(None),
+):
+    """
+    Сборки + словари модулей ровно для тех типов оружия, что встречаются в сборках.
+    Один запрос вместо /api/builds + N× /api/modules/{type}; всё собирается из кэшей.
+    Ответ: {"builds": [...], "next": курсор|null, "modules": {weapon_type: {category: [...]}}}
     """
     try:
-        builds = get_all_builds()
+        try:
+            builds_version, builds, next_cursor = await run_db(get_builds_cached, category, limit, after)
+        except ValueError:
+            return JSONResponse({"error": "Некорректный курсор"}, status_code=400)
 
-        if category != "all":
-            builds = [b for b in builds if category in (b.get("categories") or [])]
+        etag = f'W/"bundle-{builds_version}-{modules_cache_version()}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
 
-        def top_priority(b):
-            if b.get("top1"): return 1
-            if b.get("top2"): return 2
-            if b.get("top3"): return 3
-            return 999
+        weapon_types = sorted({b["weapon_type"] for b in builds if b.get("weapon_type")})
+        modules = await run_db(lambda: {t: modules_grouped_cached(t) for t in weapon_types})
+        return JSONResponse({"builds": builds, "next": next_cursor, "modules": modules}, headers=headers)
+
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.get("/api/builds/changes")
+async def api_builds_changes(since: int = Query(0, ge=0)):
+    """
+    Инкрементальная синхронизация: что изменилось после ревизии since.
+    {"revision": N, "reset": bool, "upserts": [...], "deletes": [id, ...]}
+    Клиент сохраняет revision и в следующий раз шлёт её как since.
+    При reset=True в upserts весь список — локальную копию нужно заменить.
+    """
+    try:
+        return JSONResponse(await run_db(get_build_changes, since))
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
 
-        def date_ts(b):
-            s = (b.get("date") or "").strip()
-            for fmt in ("%d.%m.%Y", "%Y-%m-%d", "%Y.%m.%d"):
-                try:
-                    return datetime.strptime(s, fmt).timestamp()
-                except Exception:
-                    continue
-            return 0
 
-        builds.sort(key=lambda b: (top_priority(b), -date_ts(b)))
-        return JSONResponse(builds)
+@app.get("/api/builds/{build_id}")
+async def api_build_detail(build_id: int, lang: str = Query("en")):
+    """
+    Полная сборка с вкладками (для раскрытия карточки из view=summary).
+    """
+    if lang not in ("en", "ru"):
+        return JSONResponse({"error": "Поддерживаются lang=en и lang=ru"}, status_code=400)
 
+    try:
+        build = await run_db(get_build_by_id, build_id)
+        if not build:
+            return JSONResponse({"error": "Сборка не найдена"}, status_code=404)
+        # перевод может впервые загрузить словари модулей из БД
+        return JSONResponse(await run_db(lambda: localize_builds([build], lang)[0]))
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
@@ -382,35 +601,16 @@ async def api_builds(category: str = Query("all")):
 async def create_build(request: Request, data: dict = Body(...)):
     """
     Создание сборки (только админы).
-    Обеспечивает уникальность категорий «Новинки» и «Популярное».
+    Эксклюзивные категории («Новинки», «Популярное», ...) снимаются с других сборок
+    в той же транзакции (см. database._save_build_categories).
     """
     _, is_admin, _ = extract_user_roles(data.get("initData", ""))
     if not is_admin:
         return JSONResponse({"error": "Недостаточно прав"}, status_code=403)
 
     try:
-        # Снимаем уникальные категории с других сборок
-        conn = sqlite3.connect("/opt/ndloadouts_storage/builds.db")
-        cursor = conn.cursor()
-
-        for unique_cat in ["Новинки", "Популярное"]:
-            if unique_cat in data.get("categories", []):
-                cursor.execute("SELECT id, categories FROM builds")
-                for row in cursor.fetchall():
-                    b_id, cats_raw = row
-                    try:
-                        cats = eval(cats_raw) if isinstance(cats_raw, str) else cats_raw
-                    except:
-                        cats = []
-                    if unique_cat in cats:
-                        cats = [c for c in cats if c != unique_cat]
-                        cursor.execute("UPDATE builds SET categories = ? WHERE id = ?", (str(cats), b_id))
-
-        conn.commit()
-        conn.close()
-
         # Сохраняем сборку
-        add_build(data)
+        await run_db(add_build, data)
         return JSONResponse({"status": "ok"})
     except Exception as e:
         return JSONResponse({"status": "error", "detail": str(e)}, status_code=500)
@@ -420,7 +620,7 @@ async def create_build(request: Request, data: dict = Body(...)):
 async def update_build(build_id: str, request: Request):
     """
     Обновление сборки (только админы).
-    Также поддерживает уникальность категорий «Новинки» / «Популярное».
+    Также поддерживает эксклюзивные категории («Новинки» / «Популярное» / ...).
     """
     body = await request.json()
     _, is_admin, _ = extract_user_roles(body.get("initData", ""))
@@ -428,26 +628,7 @@ async def update_build(build_id: str, request: Request):
         return JSONResponse({"error": "Недостаточно прав"}, status_code=403)
 
     try:
-        conn = sqlite3.connect("/opt/ndloadouts_storage/builds.db")
-        cursor = conn.cursor()
-
-        for unique_cat in ["Новинки", "Популярное"]:
-            if unique_cat in body.get("categories", []):
-                cursor.execute("SELECT id, categories FROM builds")
-                for row in cursor.fetchall():
-                    b_id, cats_raw = row
-                    try:
-                        cats = eval(cats_raw) if isinstance(cats_raw, str) else cats_raw
-                    except:
-                        cats = []
-                    if unique_cat in cats and str(b_id) != str(build_id):
-                        cats = [c for c in cats if c != unique_cat]
-                        cursor.execute("UPDATE builds SET categories = ? WHERE id = ?", (str(cats), b_id))
-
-        conn.commit()
-        conn.close()
-
-        update_build_by_id(build_id, body)
+        await run_db(update_build_by_id, build_id, body)
         return JSONResponse({"status": "ok"})
     except Exception as e:
         return JSONResponse({"status": "error", "detail": str(e)}, status_code=500)
@@ -464,11 +645,42 @@ async def delete_build(build_id: str, request: Request):
         return JSONResponse({"error": "Недостаточно прав"}, status_code=403)
 
     try:
-        delete_build_by_id(build_id)
+        await run_db(delete_build_by_id, build_id)
         return {"status": "ok"}
     except Exception as e:
         return JSONResponse({"status": "error", "detail": str(e)}, status_code=500)
 
+@app.get("/api/categories/exclusive")
+def api_exclusive_categories():
+    """
+    Категории, которые одновременно может носить только одна сборка.
+    """
+    return get_exclusive_categories()
+
+
+@app.post("/api/categories/exclusive")
+async def api_exclusive_categories_add(payload: dict = Body(...)):
+    """
+    Объявить категорию эксклюзивной (только админы).
+    """
+    ensure_admin_from_init(payload.get("initData", ""))
+    category = (payload.get("category") or "").strip()
+    if not category:
+        raise HTTPException(status_code=400, detail="Не указана категория")
+    await run_db(add_exclusive_category, category)
+    return {"status": "ok"}
+
+
+@app.delete("/api/categories/exclusive/{category}")
+async def api_exclusive_categories_delete(category: str, payload: dict = Body(...)):
+    """
+    Снять правило эксклюзивности с категории (только админы).
+    """
+    ensure_admin_from_init(payload.get("initData", ""))
+    if not await run_db(delete_exclusive_category, category):
+        raise HTTPException(status_code=404, detail=f"Категория '{category}' не эксклюзивная")
+    return {"status": "ok"}
+
 # -----------------------------------------------------
 # Вспомогательные API для Warzone (типы, админы, /me)
 # -----------------------------------------------------
@@ -500,7 +712,7 @@ async def get_me(data: dict = Body(...)):
         first_name = user_json.get("first_name", "")
         username = user_json.get("username", "")
 
-        save_user(user_id, first_name, username)
+        await run_db(save_user, user_id, first_name, username)
 
         env_vars = dotenv_values("/opt/ndloadouts/.env")
         admin_ids = set(map(str.strip, env_vars.get("ADMIN_IDS", "").split(",")))
@@ -525,12 +737,12 @@ async def get_admins():
     """
     Список главных и доп. админов с именами из user_profiles.
     """
-    users = get_all_users()
     admin_ids = set(map(str.strip, os.getenv("ADMIN_IDS", "").split(",")))
     admin_dop = set(map(str.strip, os.getenv("ADMIN_DOP", "").split(",")))
+    users = await run_db(get_users, [uid for uid in admin_ids | admin_dop if uid])
 
     def get_name(uid):
-        user = next((u for u in users if str(u["id"]) == uid), None)
+        user = users.get(uid)
         return user["first_name"] if user else "Без имени"
 
     return {
@@ -570,10 +782,11 @@ async def assign_admin(data: dict = Body(...)):
                 "Вы были <b>назначены администратором</b> в ND Loadouts.\n"
                 "Теперь у вас есть доступ к добавлению и редактированию сборок."
             )
-            requests.post(
-                f"https://api.telegram.org/bot{bot_token}/sendMessage",
-                json={"chat_id": user_id, "text": message, "parse_mode": "HTML"}, timeout=5
-            )
+            async with httpx.AsyncClient(timeout=5) as client:
+                await client.post(
+                    f"https://api.telegram.org/bot{bot_token}/sendMessage",
+                    json={"chat_id": user_id, "text": message, "parse_mode": "HTML"}
+                )
         except Exception as e:
             print(f"[!] Ошибка отправки уведомления: {e}")
 
@@ -606,11 +819,26 @@ async def remove_admin(data: dict = Body(...)):
 # =====================================================
 # 📊 ANALYTICS (с рассылкой)
 # =====================================================
+def analytics_profile_names(user_ids: list) -> dict:
+    """
+    Имена из Telegram-профилей (users в builds.db) для профилей аналитики — раз на сброс буфера.
+    """
+    return get_users(user_ids)
+
+
+analytics_buffer = AnalyticsBuffer(ANALYTICS_DB, profile_lookup=analytics_profile_names)
+
+
 @app.post("/api/analytics")
 async def save_analytics(data: dict = Body(...)):
     """
     Быстрое логирование событий аналитики + апдейт профиля пользователя.
+    Событие только кладётся в буфер (см. analytics_buffer) — в БД оно попадёт
+    пачкой при ближайшем сбросе, ответ не ждёт SQLite.
     """
+    error = event_error(data)
+    if error:
+        return JSONResponse({"status": "error", "detail": error}, status_code=400)
     try:
         user_id = data.get("user_id", "anonymous")
         action = data.get("action", "unknown")
@@ -620,59 +848,163 @@ async def save_analytics(data: dict = Body(...)):
         if user_id == "anonymous" or not user_id:
             return {"status": "ok"}
 
-        details_json = json.dumps(details, ensure_ascii=False) if details else "{}"
-        conn = sqlite3.connect(ANALYTICS_DB)
-        cur = conn.cursor()
+        if not analytics_buffer.add(user_id, action, details, timestamp):
+            return JSONResponse({"status": "error", "detail": "Буфер аналитики переполнен"}, status_code=503)
+        return {"status": "ok"}
+    except Exception as e:
+        print(f"❌ Analytics save error: {e}")
+        return JSONResponse({"status": "error", "detail": str(e)}, status_code=500)
 
-        cur.execute(
-            "INSERT INTO analytics (user_id, action, details, timestamp) VALUES (?, ?, ?, ?)",
-            (str(user_id), action, details_json, timestamp)
-        )
 
-        platform = details.get("platform", "unknown")
-        now_iso = datetime.now().isoformat()
+ANALYTICS_BATCH_MAX = 200  # событий в одном запросе /api/analytics/batch
 
-        # Обновляем профиль (with Telegram-профилем, если есть)
-        user_info = {}
-        try:
-            users = get_all_users()
-            user_info = next((u for u in users if str(u["id"]) == str(user_id)), {})
-        except:
-            user_info = {}
 
-        cur.execute("""
-            INSERT INTO user_profiles (user_id, first_name, username, last_seen, platform, total_actions, first_seen, last_action)
-            VALUES (?, ?, ?, ?, ?, 1, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET
-                last_seen = excluded.last_seen,
-                platform = excluded.platform,
-                total_actions = total_actions + 1,
-                last_action = excluded.last_action
-        """, (
-            str(user_id),
-            user_info.get('first_name', ''),
-            user_info.get('username', ''),
-            timestamp,
-            platform,
-            now_iso,
-            action
-        ))
-
-        conn.commit()
-        conn.close()
-        return {"status": "ok"}
+@app.post("/api/analytics/batch")
+async def save_analytics_batch(request: Request):
+    """
+    Пачка событий одним запросом: {"events": [{user_id, action, details, timestamp}, ...]}.
+    Клиент (static/analytics.js) копит события и шлёт их по таймеру и при закрытии
+    WebApp через sendBeacon — поэтому тело читаем сами, не полагаясь на Content-Type.
+    """
+    try:
+        data = json.loads(await request.body() or b"{}")
+        events = data.get("events") if isinstance(data, dict) else data
+        if not isinstance(events, list):
+            return JSONResponse({"status": "error", "detail": "events: ожидается список"}, status_code=400)
+        if len(events) > ANALYTICS_BATCH_MAX:
+            return JSONResponse({"status": "error", "detail": f"Не больше {ANALYTICS_BATCH_MAX} событий"},
+                                status_code=413)
+        # Хоть одно битое событие — отклоняем пачку целиком, ещё до буфера
+        for i, event in enumerate(events):
+            error = event_error(event)
+            if error:
+                return JSONResponse({"status": "error", "detail": f"events[{i}]: {error}"}, status_code=400)
+
+        accepted = dropped = 0
+        for event in events:
+            user_id = event.get("user_id", "anonymous")
+            if user_id == "anonymous" or not user_id:
+                continue
+            if analytics_buffer.add(user_id, event.get("action", "unknown"), event.get("details", {}),
+                                    event.get("timestamp")):
+                accepted += 1
+            else:
+                dropped += 1
+        if dropped and not accepted:
+            return JSONResponse({"status": "error", "detail": "Буфер аналитики переполнен"}, status_code=503)
+        return {"status": "ok", "accepted": accepted, "dropped": dropped}
+    except ValueError:
+        return JSONResponse({"status": "error", "detail": "Некорректный JSON"}, status_code=400)
     except Exception as e:
-        print(f"❌ Analytics save error: {e}")
+        print(f"❌ Analytics batch error: {e}")
         return JSONResponse({"status": "error", "detail": str(e)}, status_code=500)
 
 
-@app.get("/api/analytics/dashboard")
-async def get_analytics_dashboard():
+def format_dashboard_user(row) -> dict:
     """
-    Сводная панель: счетчики, популярные действия, пользователи, последние события.
+    Строка user_profiles → карточка пользователя для дашборда.
     """
-    try:
-        conn = sqlite3.connect(ANALYTICS_DB)
+    user_id, first_name, username, last_seen, platform, total_actions, first_seen, last_action = row
+
+    # Онлайн, если активен последние 2 минуты
+    if last_seen:
+        try:
+            last_seen_dt = datetime.fromisoformat(last_seen.replace('Z', '+00:00'))
+            time_diff = datetime.now(timezone.utc) - last_seen_dt
+            is_online = time_diff.total_seconds() < 120
+        except:
+            is_online = False
+    else:
+        is_online = False
+
+    user_display = f"{first_name or 'Пользователь'}"
+    if username:
+        user_display += f" (@{username})"
+    user_display += f" | ID: {user_id}"
+
+    last_action_text = {
+        'session_start': '🟢 Вошел в бот',
+        'view_build': '🔫 Смотрел сборку',
+        'search': '🔍 Искал',
+        'open_screen': '📱 Открыл экран',
+        'click_button': '🖱️ Кликнул',
+        'switch_category': '📂 Сменил категорию'
+    }.get(last_action, last_action)
+
+    return {
+        "id": user_id,
+        "name": user_display,
+        "username": username,
+        "first_name": first_name,
+        "status": "online" if is_online else "offline",
+        "platform": platform,
+        "actions_count": total_actions,
+        "last_seen": prettify_time(last_seen),
+        "first_seen": prettify_time(first_seen),
+        "last_action": last_action_text
+    }
+
+
+DASHBOARD_USERS_CHUNK = 500  # строк user_profiles на одно обращение к БД при отдаче списка
+
+
+def iter_dashboard_users():
+    """
+    Пользователи дашборда для StreamingResponse, по last_seen (новые сверху).
+    Читаем кусками по DASHBOARD_USERS_CHUNK с курсором (last_seen, rowid) и отдаём
+    соединение в пул до первого yield: медленный клиент не держит соединение analytics.db,
+    которое нужно и писателю. Строки без last_seen идут в конце.
+    """
+    after = None  # (last_seen, rowid) последней отданной строки
+    while True:
+        with storage.connection(ANALYTICS_DB) as conn:
+            if after is None:
+                where, params = "last_seen IS NOT NULL", ()
+            elif after[0] is not None:
+                where, params = "last_seen IS NOT NULL AND (last_seen, rowid) < (?, ?)", after
+            elif after[1] is None:
+                where, params = "last_seen IS NULL", ()
+            else:
+                where, params = "last_seen IS NULL AND rowid < ?", (after[1],)
+            rows = conn.execute(f"""
+                SELECT rowid, user_id, first_name, username, last_seen, platform,
+                       total_actions, first_seen, last_action
+                FROM user_profiles
+                WHERE {where}
+                ORDER BY last_seen DESC, rowid DESC
+                LIMIT ?
+            """, (*params, DASHBOARD_USERS_CHUNK)).fetchall()
+
+        for row in rows:
+            yield format_dashboard_user(row[1:])
+
+        if len(rows) == DASHBOARD_USERS_CHUNK:
+            after = (rows[-1][4], rows[-1][0])
+        elif after is None or after[0] is not None:
+            # Пользователи с last_seen закончились — добираем тех, у кого его нет
+            after = (None, None)
+        else:
+            return
+
+
+def rollup_since(granularity: str, periods: int) -> str:
+    """
+    Первый bucket роллапа granularity за последние periods минут/часов/дней (UTC).
+    """
+    step = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1), "day": timedelta(days=1)}[granularity]
+    start = datetime.now(timezone.utc) - step * (periods - 1)
+    return start.strftime("%Y-%m-%dT%H:%M")[:ROLLUPS[granularity][1]]
+
+
+def read_dashboard_stats(days: int | None = None):
+    """
+    Счётчики, популярные действия и последние события для дашборда (синхронно, через run_db).
+    Действия считаются по дневному роллапу (days — только последние N дней), а не по всей
+    таблице analytics: стоимость зависит от периода, а не от длины истории.
+    """
+    day_table = ROLLUPS["day"][0]
+    since = rollup_since("day", days) if days else ""
+    with storage.connection(ANALYTICS_DB) as conn:
         cur = conn.cursor()
 
         cur.execute("SELECT COUNT(*) FROM user_profiles")
@@ -682,43 +1014,47 @@ async def get_analytics_dashboard():
         cur.execute("SELECT COUNT(*) FROM user_profiles WHERE last_seen > ?", (two_min_ago,))
         online_users = cur.fetchone()[0]
 
-        cur.execute("SELECT COUNT(*) FROM analytics")
+        cur.execute(f"SELECT COALESCE(SUM(count), 0) FROM {day_table} WHERE bucket >= ?", (since,))
         total_actions = cur.fetchone()[0]
 
-        cur.execute("SELECT COUNT(*) FROM errors")
+        cur.execute("SELECT COALESCE(MAX(value), 0) FROM analytics_counters WHERE name = 'errors'")
         total_errors = cur.fetchone()[0]
 
-        cur.execute("""
-            SELECT action, COUNT(*) as count 
-            FROM analytics 
-            WHERE action NOT IN ('session_start', 'session_end', 'click_button')
+        cur.execute(f"""
+            SELECT action, SUM(count) as count 
+            FROM {day_table} 
+            WHERE bucket >= ? AND action NOT IN ('session_start', 'session_end', 'click_button')
             GROUP BY action 
             ORDER BY count DESC 
             LIMIT 8
-        """)
+        """, (since,))
         popular_actions = cur.fetchall()
 
-        cur.execute("""
-            SELECT 
-                user_id, first_name, username, last_seen, platform, 
-                total_actions, first_seen, last_action
-            FROM user_profiles 
-            ORDER BY last_seen DESC
-        """)
-        users_data = cur.fetchall()
-
+        # Последние по порядку поступления (id) — берутся с конца индекса, без сортировки всей таблицы
         cur.execute("""
             SELECT a.user_id, a.action, a.details, a.timestamp,
                    u.first_name, u.username, u.platform
             FROM analytics a
             LEFT JOIN user_profiles u ON a.user_id = u.user_id
             WHERE a.user_id != 'anonymous'
-            ORDER BY a.timestamp DESC
+            ORDER BY a.id DESC
             LIMIT 30
         """)
         actions_data = cur.fetchall()
 
-        conn.close()
+    return (total_users, online_users, total_actions, total_errors), popular_actions, actions_data
+
+
+@app.get("/api/analytics/dashboard")
+async def get_analytics_dashboard(days: int | None = Query(None, ge=1, le=3650)):
+    """
+    Сводная панель: счетчики, популярные действия, пользователи, последние события.
+    days — считать действия только за последние N дней (по умолчанию — вся история).
+    Список users отдаётся потоком (см. iter_dashboard_users).
+    """
+    try:
+        counts, popular_actions, actions_data = await run_db(read_dashboard_stats, days)
+        total_users, online_users, total_actions, total_errors = counts
 
         formatted_popular_actions = []
         for action, count in popular_actions:
@@ -731,46 +1067,6 @@ async def get_analytics_dashboard():
             }.get(action, action)
             formatted_popular_actions.append({"action": action_name, "count": count})
 
-        formatted_users = []
-        for user_id, first_name, username, last_seen, platform, total_actions, first_seen, last_action in users_data:
-            # Онлайн, если активен последние 2 минуты
-            if last_seen:
-                try:
-                    last_seen_dt = datetime.fromisoformat(last_seen.replace('Z', '+00:00'))
-                    time_diff = datetime.now(timezone.utc) - last_seen_dt
-                    is_online = time_diff.total_seconds() < 120
-                except:
-                    is_online = False
-            else:
-                is_online = False
-
-            user_display = f"{first_name or 'Пользователь'}"
-            if username:
-                user_display += f" (@{username})"
-            user_display += f" | ID: {user_id}"
-
-            last_action_text = {
-                'session_start': '🟢 Вошел в бот',
-                'view_build': '🔫 Смотрел сборку',
-                'search': '🔍 Искал',
-                'open_screen': '📱 Открыл экран',
-                'click_button': '🖱️ Кликнул',
-                'switch_category': '📂 Сменил категорию'
-            }.get(last_action, last_action)
-
-            formatted_users.append({
-                "id": user_id,
-                "name": user_display,
-                "username": username,
-                "first_name": first_name,
-                "status": "online" if is_online else "offline",
-                "platform": platform,
-                "actions_count": total_actions,
-                "last_seen": prettify_time(last_seen),
-                "first_seen": prettify_time(first_seen),
-                "last_action": last_action_text
-            })
-
         formatted_actions = []
         for user_id, action, details, timestamp, first_name, username, platform in actions_data:
             user_display = f"{first_name or 'Пользователь'}"
@@ -816,7 +1112,8 @@ async def get_analytics_dashboard():
                 "time": prettify_time(timestamp)
             })
 
-        return {
+        # Список пользователей растёт без ограничений — стримим его из курсора
+        return StreamingResponse(iter_json_object({
             "stats": {
                 "total_users": total_users,
                 "online_users": online_users,
@@ -824,9 +1121,9 @@ async def get_analytics_dashboard():
                 "total_errors": total_errors
             },
             "popular_actions": formatted_popular_actions,
-            "users": formatted_users,
+            "users": iter_dashboard_users(),
             "recent_activity": formatted_actions
-        }
+        }), media_type="application/json")
 
     except Exception as e:
         print(f"❌ Dashboard error: {e}")
@@ -838,19 +1135,76 @@ async def get_analytics_dashboard():
         }
 
 
+TIMESERIES_DEFAULT_PERIODS = {"minute": 120, "hour": 48, "day": 30}
+TIMESERIES_MAX_PERIODS = {"minute": 60 * 48, "hour": 24 * 90, "day": 3650}
+
+
+def read_timeseries(granularity: str, periods: int, action: str | None, platform: str | None) -> list:
+    table = ROLLUPS[granularity][0]
+    where, params = ["bucket >= ?"], [rollup_since(granularity, periods)]
+    if action:
+        where.append("action = ?")
+        params.append(action)
+    if platform:
+        where.append("platform = ?")
+        params.append(platform)
+    with storage.connection(ANALYTICS_DB) as conn:
+        rows = conn.execute(f"""
+            SELECT bucket, action, SUM(count)
+            FROM {table}
+            WHERE {' AND '.join(where)}
+            GROUP BY bucket, action
+            ORDER BY bucket
+        """, params).fetchall()
+
+    buckets: dict[str, dict] = {}
+    for bucket, row_action, count in rows:
+        point = buckets.setdefault(bucket, {"bucket": bucket, "total": 0, "actions": {}})
+        point["total"] += count
+        point["actions"][row_action] = count
+    return list(buckets.values())
+
+
+@app.get("/api/analytics/timeseries")
+async def get_analytics_timeseries(
+    granularity: str = Query("hour"),
+    periods: int | None = Query(None, ge=1),
+    action: str | None = Query(None),
+    platform: str | None = Query(None),
+):
+    """
+    Действия по времени из роллапов: granularity=minute|hour|day, periods — сколько последних
+    минут/часов/дней (UTC). Пустые интервалы не возвращаются.
+    {"granularity", "since", "points": [{"bucket", "total", "actions": {action: count}}]}
+    """
+    if granularity not in ROLLUPS:
+        return JSONResponse({"error": "Поддерживаются granularity=minute, hour, day"}, status_code=400)
+    periods = min(periods or TIMESERIES_DEFAULT_PERIODS[granularity], TIMESERIES_MAX_PERIODS[granularity])
+    try:
+        points = await run_db(read_timeseries, granularity, periods, action, platform)
+        return {"granularity": granularity, "since": rollup_since(granularity, periods), "points": points}
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
 @app.delete("/api/analytics/clear")
 async def clear_analytics():
     """
-    Очистка всей статистики (analytics/errors/user_profiles).
+    Очистка всей статистики (analytics/errors/user_profiles и роллапы).
     """
+    def clear():
+        with storage.connection(ANALYTICS_DB) as conn:
+            conn.execute("DELETE FROM analytics")
+            conn.execute("DELETE FROM errors")
+            conn.execute("DELETE FROM user_profiles")
+            for table, _ in ROLLUPS.values():
+                conn.execute(f"DELETE FROM {table}")
+            conn.execute("DELETE FROM analytics_counters")
+
     try:
-        conn = sqlite3.connect(ANALYTICS_DB)
-        cur = conn.cursor()
-        cur.execute("DELETE FROM analytics")
-        cur.execute("DELETE FROM errors")
-        cur.execute("DELETE FROM user_profiles")
-        conn.commit()
-        conn.close()
+        # События, ещё лежащие в буфере, тоже относятся к очищаемой статистике
+        await run_db(analytics_buffer.flush)
+        await storage.write_async(ANALYTICS_DB, clear)
         return {"status": "ok", "message": "Вся статистика очищена"}
     except Exception as e:
         return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
@@ -870,17 +1224,17 @@ async def get_broadcast_users():
     """
     Список пользователей для рассылки (не anonymous).
     """
+    def read_users():
+        with storage.connection(ANALYTICS_DB) as conn:
+            return conn.execute("""
+                SELECT user_id, first_name, username 
+                FROM user_profiles 
+                WHERE user_id != 'anonymous'
+                ORDER BY last_seen DESC
+            """).fetchall()
+
     try:
-        conn = sqlite3.connect(ANALYTICS_DB)
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT user_id, first_name, username 
-            FROM user_profiles 
-            WHERE user_id != 'anonymous'
-            ORDER BY last_seen DESC
-        """)
-        users = cur.fetchall()
-        conn.close()
+        users = await run_db(read_users)
 
         formatted_users = []
         for user_id, first_name, username in users:
@@ -915,28 +1269,29 @@ async def send_broadcast(data: dict = Body(...)):
         success_count, failed_count = 0, 0
         results = []
 
-        for target_user_id in user_ids:
-            try:
-                response = requests.post(
-                    f"https://api.telegram.org/bot{bot_token}/sendMessage",
-                    json={
-                        "chat_id": target_user_id,
-                        "text": f"📢 Рассылка от NDHQ:\n\n{message}",
-                        "parse_mode": "HTML"
-                    },
-                    timeout=10
-                )
-                if response.status_code == 200:
-                    success_count += 1
-                    results.append({"user_id": target_user_id, "status": "success"})
-                else:
+        # Одно асинхронное соединение на всю рассылку: ожидание Telegram не держит event loop
+        async with httpx.AsyncClient(timeout=10) as client:
+            for target_user_id in user_ids:
+                try:
+                    response = await client.post(
+                        f"https://api.telegram.org/bot{bot_token}/sendMessage",
+                        json={
+                            "chat_id": target_user_id,
+                            "text": f"📢 Рассылка от NDHQ:\n\n{message}",
+                            "parse_mode": "HTML"
+                        }
+                    )
+                    if response.status_code == 200:
+                        success_count += 1
+                        results.append({"user_id": target_user_id, "status": "success"})
+                    else:
+                        failed_count += 1
+                        results.append({"user_id": target_user_id, "status": "failed", "error": response.text})
+
+                    await asyncio.sleep(0.1)  # anti-spam
+                except Exception as e:
                     failed_count += 1
-                    results.append({"user_id": target_user_id, "status": "failed", "error": response.text})
-
-                await asyncio.sleep(0.1)  # anti-spam
-            except Exception as e:
-                failed_count += 1
-                results.append({"user_id": target_user_id, "status": "failed", "error": str(e)})
+                    results.append({"user_id": target_user_id, "status": "failed", "error": str(e)})
 
         return {
             "status": "ok",
@@ -957,26 +1312,27 @@ async def send_broadcast(data: dict = Body(...)):
 # 🧾 VERSION HISTORY API (UPDATED WITH DATE)
 # =====================================================
 
+def format_version(v: dict) -> dict:
+    return {
+        "id": v.get("id"),
+        "version": v.get("version"),
+        "title": v.get("title"),
+        "content": v.get("content"),
+        "status": v.get("status"),
+        "date": v.get("date"),  # ✅ новая дата
+        "created_at": prettify_time(v.get("created_at")),
+        "updated_at": prettify_time(v.get("updated_at")),
+    }
+
+
 @app.get("/api/version")
-def api_version_published():
+def api_version_published(request: Request):
     """
-    ✅ Получить только опубликованные версии
+    ✅ Получить только опубликованные версии (готовые байты из response_cache)
     """
     try:
-        versions = get_versions(published_only=True)
-        return [
-            {
-                "id": v.get("id"),
-                "version": v.get("version"),
-                "title": v.get("title"),
-                "content": v.get("content"),
-                "status": v.get("status"),
-                "date": v.get("date"),  # ✅ новая дата
-                "created_at": prettify_time(v.get("created_at")),
-                "updated_at": prettify_time(v.get("updated_at")),
-            }
-            for v in versions
-        ]
+        return cached_json(request, "version", "published",
+                           lambda: [format_version(v) for v in get_versions(published_only=True)])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -993,19 +1349,7 @@ def api_version_all(request: Request):
         raise HTTPException(status_code=403, detail="Недостаточно прав")
 
     versions = get_versions(published_only=False)
-    return [
-        {
-            "id": v.get("id"),
-            "version": v.get("version"),
-            "title": v.get("title"),
-            "content": v.get("content"),
-            "status": v.get("status"),
-            "date": v.get("date"),  # ✅ добавили дату
-            "created_at": prettify_time(v.get("created_at")),
-            "updated_at": prettify_time(v.get("updated_at")),
-        }
-        for v in versions
-    ]
+    return [format_version(v) for v in versions]
 
 
 @app.post("/api/version")
@@ -1032,6 +1376,7 @@ def api_version_add(data: dict = Body(...)):
 
     try:
         add_version(version, title, content, status, date)
+        response_cache.invalidate("version")
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=400, detail=f"Версия {version} уже существует")
 
@@ -1056,6 +1401,7 @@ def api_version_update(version_id: int, data: dict = Body(...)):
         raise HTTPException(status_code=400, detail="Все поля обязательны")
 
     update_version(version_id, version, title, content, date)
+    response_cache.invalidate("version")
     return {"status": "ok", "message": "Версия обновлена"}
 
 
@@ -1069,6 +1415,7 @@ def api_version_publish(version_id: int, data: dict = Body(...)):
         raise HTTPException(status_code=403, detail="Недостаточно прав")
 
     set_version_status(version_id, "published")
+    response_cache.invalidate("version")
     return {"status": "ok", "message": "Версия опубликована"}
 
 
@@ -1082,6 +1429,7 @@ def api_version_draft(version_id: int, data: dict = Body(...)):
         raise HTTPException(status_code=403, detail="Недостаточно прав")
 
     set_version_status(version_id, "draft")
+    response_cache.invalidate("version")
     return {"status": "ok", "message": "Версия скрыта (черновик)"}
 
 
@@ -1095,6 +1443,7 @@ def api_version_delete(version_id: int, data: dict = Body(...)):
         raise HTTPException(status_code=403, detail="Недостаточно прав")
 
     delete_version(version_id)
+    response_cache.invalidate("version")
     return {"status": "ok", "message": "Версия удалена"}
 
 
@@ -1102,39 +1451,16 @@ def api_version_delete(version_id: int, data: dict = Body(...)):
 # 🪖 BATTLEFIELD — BUILDS API
 # =====================================================
 @app.get("/api/bf/builds")
-async def bf_get_builds(mode: str = Query("all")):
+async def bf_get_builds(request: Request, mode: str = Query("all")):
     """
     Получить все BF-сборки (фильтр по mode: 'mp', 'br' или 'all').
     tabs/categories приводятся к JSON-массивам.
+    Готовые байты из response_cache (одна копия на все запросы); при промахе
+    JSON собирается прямо из курсора, без промежуточного списка.
     """
     try:
-        builds = get_all_bf_builds()
-
-        if mode != "all":
-            builds = [b for b in builds if b.get("mode", "mp") == mode]
-
-        formatted = []
-        for b in builds:
-            if isinstance(b, (list, tuple)):
-                keys = ["id", "title", "weapon_type", "top1", "top2", "top3", "date", "tabs", "categories", "mode"]
-                b = dict(zip(keys, b[:len(keys)]))
-
-            if isinstance(b.get("tabs"), str):
-                try:
-                    b["tabs"] = json.loads(b["tabs"])
-                except:
-                    b["tabs"] = []
-
-            if isinstance(b.get("categories"), str):
-                try:
-                    b["categories"] = json.loads(b["categories"])
-                except:
-                    b["categories"] = []
-
-            b["mode"] = b.get("mode", "mp")
-            formatted.append(b)
-
-        return JSONResponse(formatted)
+        return await run_db(cached_json, request, "bf_builds", mode,
+                            lambda: "".join(iter_json_array(iter_bf_builds(mode))))
     except Exception as e:
         print(f"BF builds error: {e}")
         return JSONResponse({"error": str(e)}, status_code=500)
@@ -1147,7 +1473,8 @@ async def bf_add_build(request: Request):
     """
     data = await request.json()
     try:
-        add_bf_build(data)
+        await run_db(add_bf_build, data)
+        response_cache.invalidate("bf_builds")
         return {"status": "ok", "message": "Build added"}
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
@@ -1160,7 +1487,8 @@ async def bf_update_build(build_id: int, request: Request):
     """
     data = await request.json()
     try:
-        update_bf_build(build_id, data)
+        await run_db(update_bf_build, build_id, data)
+        response_cache.invalidate("bf_builds")
         return {"status": "ok", "message": "Build updated"}
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
@@ -1172,7 +1500,8 @@ async def bf_delete_build(build_id: int):
     Удалить BF-сборку по ID.
     """
     try:
-        delete_bf_build(build_id)
+        await run_db(delete_bf_build, build_id)
+        response_cache.invalidate("bf_builds")
         return {"status": "ok", "message": "Build deleted"}
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
@@ -1186,7 +1515,7 @@ async def bf_get_types():
     Получить список типов BF-оружия.
     """
     try:
-        return get_bf_weapon_types()
+        return await run_db(get_bf_weapon_types)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
@@ -1198,7 +1527,7 @@ async def bf_add_type(request: Request):
     """
     data = await request.json()
     try:
-        add_bf_weapon_type(data)
+        await run_db(add_bf_weapon_type, data)
         return {"status": "ok", "message": "Type added"}
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
@@ -1210,7 +1539,7 @@ async def bf_delete_type(type_id: int):
     Удалить тип BF-оружия.
     """
     try:
-        delete_bf_weapon_type(type_id)
+        await run_db(delete_bf_weapon_type, type_id)
         return {"status": "ok", "message": "Type deleted"}
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
@@ -1224,7 +1553,7 @@ async def bf_get_modules(weapon_type: str):
     Получить модули BF по типу оружия.
     """
     try:
-        return get_bf_modules_by_type(weapon_type)
+        return await run_db(get_bf_modules_by_type, weapon_type)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
@@ -1239,20 +1568,61 @@ async def bf_add_module(request: Request):
     try:
         if not data.get("weapon_type"):
             data["weapon_type"] = "shv"
-        add_bf_module(data)
+        await run_db(add_bf_module, data)
         return {"status": "ok", "message": "Module added"}
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
 
+@app.put("/api/bf/modules/{module_id}")
+async def bf_update_module(module_id: int, request: Request):
+    """
+    Изменить модуль BF (только админы). Новый en переносится в BF-сборки.
+    """
+    data = await request.json()
+    ensure_bf_admin(request, data)
+    try:
+        result = await run_db(update_bf_module, module_id, data)
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=409, detail="Модуль с таким en уже есть в этой категории")
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+    if not result["updated"]:
+        raise HTTPException(status_code=404, detail="Модуль не найден")
+    if result["builds"]:
+        response_cache.invalidate("bf_builds")
+    return {"status": "ok", "builds_updated": result["builds"]}
+
+
+@app.get("/api/bf/modules/{module_id:int}/builds")
+async def bf_module_builds(module_id: int):
+    """
+    id BF-сборок, в которых используется модуль (по обратному индексу).
+    """
+    build_ids = await run_db(get_bf_module_usage, module_id)
+    if build_ids is None:
+        raise HTTPException(status_code=404, detail="Модуль не найден")
+    return {"builds": build_ids}
+
+
+@app.get("/api/bf/modules/{weapon_type}/usage")
+async def bf_modules_usage(weapon_type: str):
+    """
+    Счётчики использования модулей BF для редактора: {"counts": {module_id: builds}}.
+    """
+    return {"counts": await run_db(get_bf_modules_usage_counts, weapon_type)}
+
+
 @app.delete("/api/bf/modules/{module_id}")
-async def bf_delete_module(module_id: int):
+async def bf_delete_module(module_id: int, payload: dict | None = Body(None)):
     """
-    Удалить модуль BF.
+    Удалить модуль BF. Если он используется в сборках — 409, пока не передан "force": true.
     """
     try:
-        delete_bf_module(module_id)
+        await run_db(delete_bf_module, module_id, force=bool((payload or {}).get("force")))
         return {"status": "ok", "message": "Module deleted"}
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail={"error": str(e)})
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
@@ -1424,15 +1794,18 @@ def bf_update_progress(challenge_id: int, data: dict = Body(...)):
 # =====================================================
 router_bf_settings = APIRouter(prefix="/api/bf/settings", tags=["BF Settings"])
 
+BF_SETTINGS_CACHE_TTL = 300  # настройки пишет import_bf.py отдельным процессом — сброса нет, живём по TTL
+
 @router_bf_settings.get("")
-def api_get_settings(category: str | None = Query(None)):
+def api_get_settings(request: Request, category: str | None = Query(None)):
     """
     Возвращает все настройки Battlefield или конкретной категории.
     Каждая запись содержит options[] и subsettings[].
+    Готовые байты из response_cache (обновляются раз в BF_SETTINGS_CACHE_TTL секунд).
     """
     try:
-        settings = get_bf_settings(category)
-        return settings
+        return cached_json(request, "bf_settings", category, lambda: get_bf_settings(category),
+                           ttl=BF_SETTINGS_CACHE_TTL)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка загрузки настроек: {e}")
 
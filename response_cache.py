@@ -0,0 +1,126 @@
+import gzip
+import json
+import time
+import hashlib
+import threading
+
+try:
+    import brotli  # опционально: без пакета отдаём gzip/identity
+except ImportError:
+    brotli = None
+
+# =====================================================
+# Кэш готовых байтов ответа для read-mostly эндпоинтов.
+# Данные меняются только при записи админом, поэтому JSON-кодирование
+# и сжатие делаем один раз на версию данных, а не на каждый запрос.
+# =====================================================
+
+MAX_ENTRIES = 512
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+class CachedBody:
+    """Один закэшированный ответ: ETag + байты во всех поддерживаемых кодировках."""
+
+    __slots__ = ("etag", "variants", "created")
+
+    def __init__(self, raw: bytes):
+        # weak: байты различаются по Content-Encoding, содержимое одно
+        self.etag = f'W/"{hashlib.blake2b(raw, digest_size=12).hexdigest()}"'
+        self.variants = {
+            "identity": raw,
+            "gzip": gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0),
+        }
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(raw, quality=BROTLI_QUALITY)
+        self.created = time.monotonic()
+
+    def pick(self, accept_encoding: str) -> tuple[str, bytes]:
+        """Лучший вариант под Accept-Encoding клиента: br > gzip > identity."""
+        accepted = {
+            part.split(";")[0].strip().lower()
+            for part in (accept_encoding or "").split(",")
+            if part.strip() and not part.strip().endswith("q=0")
+        }
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.variants:
+                return encoding, self.variants[encoding]
+        return "identity", self.variants["identity"]
+
+
+class ResponseCache:
+    """
+    Байты ответа по (endpoint, key). version — любое значение, описывающее
+    состояние данных (например, версия кэша сборок): при его смене запись
+    пересобирается. Для эндпоинтов, которые пишутся вне процесса, задаётся ttl.
+    Эндпоинты без version сбрасываются через invalidate(): каждый сброс двигает
+    поколение эндпоинта, и сборка, начатая до сброса, в кэш уже не попадёт.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self._lock = threading.Lock()
+        self._entries: dict[tuple, tuple] = {}
+        self._generations: dict[str, int] = {}  # endpoint -> число сбросов
+        self._epoch = 0  # число сбросов всего кэша
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, endpoint: str, key, build, version=None, ttl: float | None = None) -> CachedBody:
+        """
+        Вернуть закэшированный ответ или собрать его: build() -> объект для JSON
+        (или уже готовая str/bytes).
+        """
+        cache_key = (endpoint, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            generation = self._generation(endpoint)
+        if entry is not None:
+            entry_version, body = entry
+            fresh = ttl is None or time.monotonic() - body.created < ttl
+            if entry_version == version and fresh:
+                self.hits += 1
+                return body
+
+        self.misses += 1
+        payload = build()
+        if isinstance(payload, str):
+            raw = payload.encode("utf-8")
+        elif isinstance(payload, bytes):
+            raw = payload
+        else:
+            raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        body = CachedBody(raw)
+
+        with self._lock:
+            # Пока собирали — прошла запись и invalidate(): байты могут быть старыми, не кладём
+            if generation == self._generation(endpoint):
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+                self._entries[cache_key] = (version, body)
+        return body
+
+    def _generation(self, endpoint: str) -> tuple[int, int]:
+        return self._epoch, self._generations.get(endpoint, 0)
+
+    def invalidate(self, endpoint: str | None = None):
+        """Сбросить все записи эндпоинта (или весь кэш)."""
+        with self._lock:
+            if endpoint is None:
+                self._epoch += 1
+                self._entries.clear()
+            else:
+                self._generations[endpoint] = self._generations.get(endpoint, 0) + 1
+                for k in [k for k in self._entries if k[0] == endpoint]:
+                    del self._entries[k]
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = len(self._entries)
+            size = sum(len(b.variants["identity"]) for _, b in self._entries.values())
+        return {"entries": entries, "bytes": size, "hits": self.hits, "misses": self.misses,
+                "brotli": brotli is not None}
+
+
+response_cache = ResponseCache()
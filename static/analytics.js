@@ -1,29 +1,70 @@
 // static/analytics.js
+// События копятся в очереди и уходят пачкой в /api/analytics/batch:
+// раз в FLUSH_INTERVAL_MS, как только набралось FLUSH_SIZE, при сворачивании
+// WebApp (visibilitychange) и при закрытии (web_app_close) — через sendBeacon,
+// который браузер дошлёт даже после выгрузки страницы.
 const Analytics = {
+  ENDPOINT: '/api/analytics/batch',
+  FLUSH_INTERVAL_MS: 5000,
+  FLUSH_SIZE: 20,
+  MAX_BATCH: 200, // как ANALYTICS_BATCH_MAX на сервере
+  queue: [],
+  timer: null,
+
   trackEvent(action, details = {}) {
     try {
       const user = window.Telegram?.WebApp?.initDataUnsafe?.user;
       const platform = window.Telegram?.WebApp?.platform || 'unknown';
-      
+
       // Только реальные пользователи
       if (!user?.id) return;
-      
-      // Быстрая отправка без ожидания ответа
-      fetch('/api/analytics', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          user_id: user.id,
-          action: action,
-          details: { ...details, platform },
-          timestamp: new Date().toISOString()
-        })
-      }).catch(() => {}); // Игнорируем ошибки для скорости
+
+      this.queue.push({
+        user_id: user.id,
+        action: action,
+        details: { ...details, platform },
+        timestamp: new Date().toISOString()
+      });
+
+      if (this.queue.length >= this.FLUSH_SIZE) {
+        this.flush();
+      } else if (!this.timer) {
+        this.timer = setTimeout(() => this.flush(), this.FLUSH_INTERVAL_MS);
+      }
     } catch (error) {
       // Игнорируем ошибки трекинга
     }
   },
 
+  // useBeacon — страница может выгрузиться: отдаём пачку браузеру, ответ не ждём
+  flush(useBeacon = false) {
+    if (this.timer) {
+      clearTimeout(this.timer);
+      this.timer = null;
+    }
+
+    while (this.queue.length) {
+      const events = this.queue.splice(0, this.MAX_BATCH);
+      const body = JSON.stringify({ events });
+
+      try {
+        if (useBeacon && navigator.sendBeacon &&
+            navigator.sendBeacon(this.ENDPOINT, new Blob([body], { type: 'application/json' }))) {
+          continue;
+        }
+        // keepalive — запрос переживёт закрытие страницы, если sendBeacon недоступен
+        fetch(this.ENDPOINT, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body,
+          keepalive: true
+        }).catch(() => {}); // Игнорируем ошибки для скорости
+      } catch (error) {
+        // Игнорируем ошибки трекинга
+      }
+    }
+  },
+
   trackBuildView(buildData) {
     this.trackEvent('view_build', {
       title: buildData.title,
@@ -64,7 +105,14 @@ if (window.Telegram?.WebApp?.initDataUnsafe?.user) {
 if (window.Telegram?.WebApp) {
   window.Telegram.WebApp.onEvent('web_app_close', () => {
     Analytics.trackEvent('session_end');
+    Analytics.flush(true);
   });
 }
 
+// Свернули WebApp / переключились — отправляем накопленное, пока страница жива
+document.addEventListener('visibilitychange', () => {
+  if (document.visibilityState === 'hidden') Analytics.flush(true);
+});
+window.addEventListener('pagehide', () => Analytics.flush(true));
+
 window.Analytics = Analytics;
@@ -352,7 +352,11 @@ weaponTypeSelect.addEventListener('change', async () => {
 async function loadModules(type) {
   const res = await fetch(`/api/modules/${type}`);
   const byCategory = await res.json(); // { category: Mod[] }
+  applyModules(type, byCategory);
+}
 
+// Индексирует словарь модулей типа (из /api/modules/{type} или из бандла сборок)
+function applyModules(type, byCategory) {
   const byKey = {};
   const flat = [];
   const norm = s => String(s || '').toLowerCase().trim().replace(/\s+/g, ' ');
@@ -590,8 +594,13 @@ async function loadWeaponTypesForModules() {
 // (загружает модули через /api/modules/{weaponType} и отрисовывает их на экране screen-modules-list)
 async function loadModulesForType(weaponType, label) {
   try {
-    const res = await fetch(`/api/modules/${weaponType}`);
+    const [res, usageRes] = await Promise.all([
+      fetch(`/api/modules/${weaponType}`),
+      fetch(`/api/modules/${weaponType}/usage`)
+    ]);
     const data = await res.json();
+    // Сколько сборок использует каждый модуль (обратный индекс на сервере)
+    const usage = usageRes.ok ? (await usageRes.json()).counts || {} : {};
 
     const listEl = document.getElementById('modules-list');
     if (!listEl) {
@@ -620,15 +629,20 @@ async function loadModulesForType(weaponType, label) {
         card.className = 'module-card';
         card.innerHTML = `
           <span class="mod-name">${mod.en} — ${mod.ru}</span>
+          <span class="mod-usage">${usage[mod.id] ? `в сборках: ${usage[mod.id]}` : ''}</span>
           <button class="btn btn-delete" data-id="${mod.id}">🗑</button>
         `;
     
         card.querySelector('button').addEventListener('click', async () => {
-          if (!confirm(`Удалить модуль "${mod.en}"?`)) return;
+          const used = usage[mod.id] || 0;
+          const question = used
+            ? `Модуль "${mod.en}" используется в сборках (${used}). Всё равно удалить?`
+            : `Удалить модуль "${mod.en}"?`;
+          if (!confirm(question)) return;
           await fetch(`/api/modules/${mod.id}`, {
             method: 'DELETE',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ initData: tg.initData })
+            body: JSON.stringify({ initData: tg.initData, force: used > 0 })
           });
           await loadModulesForType(weaponType, label);
         });
@@ -643,21 +657,20 @@ async function loadModulesForType(weaponType, label) {
     listEl.querySelectorAll('.delete-category-btn').forEach(btn => {
       btn.addEventListener('click', async () => {
         const category = btn.dataset.category;
-        if (!confirm(`Удалить категорию "${category}" вместе со всеми её модулями?`)) return;
+        const used = (data[category] || []).reduce((sum, mod) => sum + (usage[mod.id] || 0), 0);
+        const question = used
+          ? `Модули категории "${category}" используются в сборках (${used}). Всё равно удалить категорию?`
+          : `Удалить категорию "${category}" вместе со всеми её модулями?`;
+        if (!confirm(question)) return;
     
         try {
-          const modsToDelete = data[category] || [];
-    
-          // 🗑️ Удаляем каждый модуль этой категории
-          await Promise.all(
-            modsToDelete.map(mod =>
-              fetch(`/api/modules/${mod.id}`, {
-                method: 'DELETE',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ initData: tg.initData })
-              })
-            )
-          );
+          // 🗑️ Одним запросом удаляем все модули категории
+          const res = await fetch(`/api/modules/${weaponType}/${encodeURIComponent(category)}`, {
+            method: 'DELETE',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ initData: tg.initData, force: used > 0 })
+          });
+          if (!res.ok) throw new Error(`HTTP ${res.status}`);
     
           alert(`Категория "${category}" успешно удалена ✅`);
           await loadModulesForType(weaponType, label);
@@ -767,8 +780,11 @@ function rebuildModuleSelects() {
 // === Загрузка сборок для пользователей ===
 // === Загрузка сборок для пользователей ===
 async function loadBuilds(category = 'all') {
-  const res = await fetch(`/api/builds?category=${category}`);
-  const builds = await res.json();
+  // Сборки и словари модулей нужных типов — одним запросом.
+  // no-cache: браузер перепроверяет по ETag и при 304 отдаёт тело из своего кэша
+  const res = await fetch(`/api/builds/bundle?category=${encodeURIComponent(category)}`, { cache: 'no-cache' });
+  const bundle = await res.json();
+  const builds = bundle.builds;
 
   // если пусто
   if (!Array.isArray(builds) || builds.length === 0) {
@@ -777,9 +793,10 @@ async function loadBuilds(category = 'all') {
     return;
   }
 
-  // 🔥 ВАЖНО: Загружаем модули для всех типов оружия, которые есть в сборках
-  const uniqueTypes = [...new Set(builds.map(b => b.weapon_type))];
-  await Promise.all(uniqueTypes.map(loadModules));
+  // 🔥 ВАЖНО: модули для всех типов оружия из сборок уже пришли в бандле
+  for (const type in bundle.modules || {}) {
+    applyModules(type, bundle.modules[type]);
+  }
 
   // Рендер сборок
   renderUserBuilds(builds);
@@ -1227,7 +1244,8 @@ function formatRuDate(input) {
 // JS — функция для загрузки и отрисовки таблицы
 async function loadBuildsTable() {
   try {
-    const res = await fetch('/api/builds');
+    // Для сетки хватает summary (без вкладок); полную сборку берём при редактировании
+    const res = await fetch('/api/builds?view=summary', { cache: 'no-cache' });
     const builds = await res.json();
     const gridWrapper = document.getElementById('edit-builds-grid');
 
@@ -1322,6 +1340,11 @@ async function loadBuildsTable() {
       btn.addEventListener('click', async (e) => {
         e.stopPropagation();
         const id = btn.dataset.id;
+
+        const detailRes = await fetch(`/api/builds/${id}`);
+        if (!detailRes.ok) return alert('Не удалось загрузить сборку');
+        build = await detailRes.json();
+
         currentEditId = id;
 
         showScreen('screen-form');
@@ -1398,7 +1421,7 @@ async function loadBuildsTable() {
       let html = '';
       buildsToRender.forEach((build, index) => {
         const weaponTypeRu = weaponTypeLabels[build.weapon_type] || build.weapon_type;
-        const tabsCount = Array.isArray(build.tabs) ? build.tabs.length : 0;
+        const tabsCount = build.tabs_count ?? (Array.isArray(build.tabs) ? build.tabs.length : 0);
         const categories = Array.isArray(build.categories) ? build.categories : [];
         
         // Бейджи категорий с эмодзи
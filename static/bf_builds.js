@@ -147,6 +147,15 @@ async function bfLoadWeaponTypesForModules() {
   }
 }
 
+// Удаление модуля; force — даже если он используется в сборках (иначе сервер ответит 409)
+function bfDeleteModule(id, force = false) {
+  return fetch(`/api/bf/modules/${id}`, {
+    method: "DELETE",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ initData: tg.initData, force }),
+  });
+}
+
 // Загрузка модулей по типу
 async function bfLoadModulesList(weaponType, label) {
   try {
@@ -172,15 +181,12 @@ async function bfLoadModulesList(weaponType, label) {
      group.querySelector(".delete-category").addEventListener("click", async () => {
        if (!confirm(`Удалить категорию "${category}" со всеми модулями?`)) return;
        try {
-         await Promise.all(
-           data[category].map(mod =>
-             fetch(`/api/bf/modules/${mod.id}`, {
-               method: "DELETE",
-               headers: { "Content-Type": "application/json" },
-               body: JSON.stringify({ initData: tg.initData }),
-             })
-           )
-         );
+         const results = await Promise.all(data[category].map(mod => bfDeleteModule(mod.id)));
+         // Модули, которые стоят в сборках, сервер без подтверждения не удаляет
+         const inUse = data[category].filter((_, i) => results[i].status === 409);
+         if (inUse.length && confirm(`Модули используются в сборках (${inUse.length} шт.). Удалить всё равно?`)) {
+           await Promise.all(inUse.map(mod => bfDeleteModule(mod.id, true)));
+         }
          await bfLoadModulesList(weaponType, label);
        } catch (err) {
          console.error("Ошибка при удалении категории:", err);
@@ -199,11 +205,13 @@ async function bfLoadModulesList(weaponType, label) {
       `;
        card.querySelector(".delete-mod").addEventListener("click", async () => {
          if (!confirm(`Удалить модуль ${mod.en}?`)) return;
-         await fetch(`/api/bf/modules/${mod.id}`, {
-           method: "DELETE",
-           headers: { "Content-Type": "application/json" },
-           body: JSON.stringify({ initData: tg.initData }),
-         });
+         const res = await bfDeleteModule(mod.id);
+         if (res.status === 409) {
+           const { detail } = await res.json();
+           if (confirm(`${detail?.error || "Модуль используется в сборках"}. Удалить всё равно?`)) {
+             await bfDeleteModule(mod.id, true);
+           }
+         }
          await bfLoadModulesList(weaponType, label);
        });
        grid.appendChild(card);
@@ -0,0 +1,490 @@
+import os
+import time
+import queue
+import asyncio
+import sqlite3
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# =====================================================
+# Пул соединений SQLite: один ограниченный пул на файл БД.
+# Соединения живут долго, PRAGMA выставляются один раз при открытии.
+# Внутри потока выдача реентерабельна: вложенный connection() того же файла
+# получает то же соединение, а commit/rollback делает только внешний блок.
+# =====================================================
+
+POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))
+ACQUIRE_TIMEOUT = float(os.getenv("SQLITE_POOL_TIMEOUT", "30"))
+# Кэш подготовленных запросов живёт вместе с соединением — в пуле он переживает вызовы
+STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))
+OPTIMIZE_INTERVAL = float(os.getenv("SQLITE_OPTIMIZE_INTERVAL", "3600"))
+# Сколько записей из очереди писатель объединяет в одну транзакцию
+WRITE_BATCH = int(os.getenv("SQLITE_WRITE_BATCH", "64"))
+# Потоки для run_db: больше, чем соединений в пуле, смысла нет — лишние будут ждать acquire()
+DB_WORKERS = int(os.getenv("SQLITE_DB_WORKERS", str(POOL_SIZE)))
+
+# PRAGMA на каждое новое соединение (journal_mode хранится в файле, но дешёв и идемпотентен)
+BASE_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("foreign_keys", "ON"),
+)
+# Профиль производительности: synchronous=NORMAL в WAL не теряет целостность, только
+# последние транзакции при отключении питания; кэш страниц и mmap — на соединение.
+TUNED_PRAGMAS = BASE_PRAGMAS + (
+    ("synchronous", os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")),
+    ("busy_timeout", int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))),
+    ("cache_size", -int(os.getenv("SQLITE_CACHE_KB", "16384"))),
+    ("mmap_size", int(os.getenv("SQLITE_MMAP_MB", "128")) * 1024 * 1024),
+    ("temp_store", "MEMORY"),
+)
+PROFILES = {"base": BASE_PRAGMAS, "tuned": TUNED_PRAGMAS}
+DEFAULT_PRAGMAS = PROFILES[os.getenv("SQLITE_PROFILE", "tuned")]
+
+
+class ConnectionPool:
+    """Ограниченный пул соединений к одному файлу БД."""
+
+    def __init__(self, path, size: int = POOL_SIZE, pragmas=DEFAULT_PRAGMAS,
+                 cached_statements: int = STATEMENT_CACHE):
+        self.path = str(path)
+        self.size = size
+        self.pragmas = tuple(pragmas)
+        self.cached_statements = cached_statements
+        self._idle: list[sqlite3.Connection] = []
+        self._open = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        # счётчики для /api/metrics
+        self.opened = 0
+        self.checkouts = 0
+        self.reentrant = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.rollbacks = 0
+        self.optimized = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # check_same_thread=False: соединение переходит между потоками, но только через пул
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=self.cached_statements)
+        for name, value in self.pragmas:
+            try:
+                conn.execute(f"PRAGMA {name} = {value}")
+            except sqlite3.DatabaseError:
+                pass
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Взять соединение (без привязки к потоку). Вернуть — release()."""
+        with self._cond:
+            self.checkouts += 1
+            if not self._idle and self._open >= self.size:
+                self.waits += 1
+                started = time.perf_counter()
+                if not self._cond.wait_for(lambda: self._idle or self._open < self.size, ACQUIRE_TIMEOUT):
+                    raise sqlite3.OperationalError(f"Пул {self.path}: нет свободных соединений за {ACQUIRE_TIMEOUT} с")
+                self.wait_seconds += time.perf_counter() - started
+            if self._idle:
+                return self._idle.pop()
+            self._open += 1
+            self.opened += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn: sqlite3.Connection):
+        # Незавершённая транзакция не должна достаться следующему потоку
+        if conn.in_transaction:
+            conn.rollback()
+            self.rollbacks += 1
+        conn.row_factory = None
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, row_mode: bool = False):
+        """
+        Соединение на время блока: commit при выходе, rollback при исключении.
+        Повторный вход в том же потоке — то же соединение, транзакцией управляет внешний блок.
+        """
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            self.reentrant += 1
+            previous = held.row_factory
+            held.row_factory = sqlite3.Row if row_mode else None
+            try:
+                yield held
+            finally:
+                held.row_factory = previous
+            return
+
+        conn = self.acquire()
+        conn.row_factory = sqlite3.Row if row_mode else None
+        self._local.conn = conn
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            self.release(conn)
+
+    def held(self) -> sqlite3.Connection | None:
+        """Соединение, которое текущий поток уже держит в with connection(), иначе None."""
+        return getattr(self._local, "conn", None)
+
+    def optimize(self):
+        """PRAGMA optimize на одном соединении пула (статистика планировщика общая на файл)."""
+        conn = self.acquire()
+        try:
+            conn.execute("PRAGMA optimize")
+            self.optimized += 1
+        finally:
+            self.release(conn)
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn in idle:
+            # SQLite советует optimize перед закрытием долгоживущего соединения
+            try:
+                conn.execute("PRAGMA optimize")
+            except sqlite3.DatabaseError:
+                pass
+            conn.close()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+                "opened": self.opened,
+                "checkouts": self.checkouts,
+                "reentrant": self.reentrant,
+                "waits": self.waits,
+                "wait_ms": round(self.wait_seconds * 1000, 2),
+                "rollbacks": self.rollbacks,
+                "optimized": self.optimized,
+            }
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path) -> ConnectionPool:
+    """Пул для файла БД (создаётся при первом обращении)."""
+    key = str(Path(path).resolve())
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(key, ConnectionPool(key))
+    return pool
+
+
+def connection(path, row_mode: bool = False):
+    """with storage.connection(DB_PATH) as conn: ... — соединение из пула файла."""
+    return get_pool(path).connection(row_mode)
+
+
+def optimize_all():
+    """Периодический PRAGMA optimize по всем открытым пулам."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        try:
+            pool.optimize()
+        except sqlite3.DatabaseError as e:
+            print(f"⚠️ PRAGMA optimize {pool.path}: {e}")
+
+
+def close_all():
+    shutdown_executor()
+    stop_writers()
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+
+
+def pool_stats() -> dict:
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.path: pool.stats() for pool in pools}
+
+
+# =====================================================
+# Очередь записи: один поток-писатель на файл БД.
+# Пишущие функции ставятся в очередь; писатель забирает всё, что накопилось
+# (до WRITE_BATCH), и выполняет одной транзакцией BEGIN IMMEDIATE ... COMMIT —
+# каждая в своём SAVEPOINT, так что ошибка одной откатывает только её.
+# Вызывающий ждёт свой Future: результат или исключение своей функции.
+# Функция работает через обычный with storage.connection(path) — в потоке писателя
+# это реентерабельный вход в его общую транзакцию.
+# =====================================================
+
+_writing = threading.local()  # callbacks текущей функции в потоке писателя
+
+
+def after_commit(callback):
+    """
+    Выполнить callback после фиксации записи: в потоке писателя — после общего COMMIT
+    (если функция не упала), в остальных случаях — сразу.
+    """
+    callbacks = getattr(_writing, "callbacks", None)
+    if callbacks is None:
+        callback()
+    else:
+        callbacks.append(callback)
+
+
+class Writer:
+    """Поток-писатель и очередь записей одного файла БД."""
+
+    def __init__(self, pool: ConnectionPool, batch: int = WRITE_BATCH):
+        self.pool = pool
+        self.batch = batch
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"sqlite-writer:{Path(pool.path).name}", daemon=True)
+        self._lock = threading.Lock()
+        # счётчики для /api/metrics
+        self.jobs = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.commit_seconds = 0.0
+        self.max_commit_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._thread.start()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future = Future()
+        # Поток уже внутри транзакции этого файла (в том числе сам писатель) —
+        # выполняем на месте, иначе ждали бы блокировку, которую держим сами
+        if self.pool.held() is not None:
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        self._queue.put((fn, args, kwargs, future, time.perf_counter()))
+        depth = self._queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return future
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            jobs = [job]
+            stopping = False
+            while len(jobs) < self.batch:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                jobs.append(job)
+            self._commit(jobs)
+            if stopping:
+                return
+
+    def _commit(self, jobs: list):
+        outcomes = []
+        try:
+            with self.pool.connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for fn, args, kwargs, _, _ in jobs:
+                    conn.execute("SAVEPOINT job")
+                    _writing.callbacks = []
+                    try:
+                        result = fn(*args, **kwargs)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO job")
+                        outcomes.append((False, e, ()))
+                    else:
+                        outcomes.append((True, result, _writing.callbacks))
+                    finally:
+                        _writing.callbacks = None
+                    conn.execute("RELEASE job")
+                started = time.perf_counter()
+            committed = time.perf_counter() - started
+        except Exception as e:
+            # Не удалась сама транзакция (блокировка, диск) — падают все записи пакета
+            _writing.callbacks = None
+            outcomes = [(False, e, ())] * len(jobs)
+            committed = 0.0
+
+        finished = time.perf_counter()
+        with self._lock:
+            self.batches += 1
+            self.jobs += len(jobs)
+            self.commit_seconds += committed
+            self.max_commit_seconds = max(self.max_commit_seconds, committed)
+            for _, _, _, _, queued in jobs:
+                self.wait_seconds += finished - queued
+                self.max_wait_seconds = max(self.max_wait_seconds, finished - queued)
+            self.failed += sum(1 for ok, _, _ in outcomes if not ok)
+
+        for (ok, value, callbacks), job in zip(outcomes, jobs):
+            future = job[3]
+            if ok:
+                for callback in callbacks:
+                    try:
+                        callback()
+                    except Exception as e:
+                        print(f"⚠️ after_commit {self.pool.path}: {e}")
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            jobs, batches = self.jobs, self.batches
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self.max_depth,
+                "jobs": jobs,
+                "failed": self.failed,
+                "batches": batches,
+                "avg_batch": round(jobs / batches, 2) if batches else 0.0,
+                "avg_commit_ms": round(self.commit_seconds / batches * 1000, 3) if batches else 0.0,
+                "max_commit_ms": round(self.max_commit_seconds * 1000, 3),
+                "avg_wait_ms": round(self.wait_seconds / jobs * 1000, 3) if jobs else 0.0,
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+            }
+
+
+_writers: dict[str, Writer] = {}
+
+
+def get_writer(path) -> Writer:
+    """Писатель файла БД (поток стартует при первой записи)."""
+    pool = get_pool(path)
+    writer = _writers.get(pool.path)
+    if writer is None:
+        with _pools_lock:
+            writer = _writers.get(pool.path)
+            if writer is None:
+                writer = _writers[pool.path] = Writer(pool)
+    return writer
+
+
+def submit_write(path, fn, *args, **kwargs) -> Future:
+    """Поставить fn(*args, **kwargs) в очередь записи файла; Future — её результат после COMMIT."""
+    return get_writer(path).submit(fn, *args, **kwargs)
+
+
+def write(path, fn, *args, **kwargs):
+    """Выполнить пишущую функцию через очередь записи и дождаться COMMIT."""
+    return submit_write(path, fn, *args, **kwargs).result()
+
+
+async def write_async(path, fn, *args, **kwargs):
+    """То же, что write(), но без занятого потока: await до COMMIT."""
+    return await asyncio.wrap_future(submit_write(path, fn, *args, **kwargs))
+
+
+def stop_writers():
+    """Дописать очереди и остановить писателей (пересоздадутся при следующей записи)."""
+    with _pools_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.stop()
+
+
+def writer_stats() -> dict:
+    with _pools_lock:
+        writers = list(_writers.values())
+    return {writer.pool.path: writer.stats() for writer in writers}
+
+
+def profile() -> dict:
+    """Действующие настройки соединений (для /api/metrics)."""
+    return {"pragmas": dict(DEFAULT_PRAGMAS), "cached_statements": STATEMENT_CACHE, "pool_size": POOL_SIZE}
+
+
+# =====================================================
+# Работа с БД из async-маршрутов: синхронные функции database*.py
+# выполняются в отдельном ограниченном пуле потоков, event loop не ждёт SQLite.
+# =====================================================
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+_executor_stats = {"calls": 0, "in_flight": 0, "max_in_flight": 0, "queue_ms": 0.0, "max_queue_ms": 0.0}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="sqlite")
+    return _executor
+
+
+async def run_db(fn, *args, **kwargs):
+    """
+    await storage.run_db(add_build, data) — вызвать блокирующую функцию БД в пуле потоков БД.
+    Исключения пробрасываются как есть, поэтому обработка ошибок в маршрутах не меняется.
+    """
+    submitted = time.perf_counter()
+
+    def call():
+        queued_ms = (time.perf_counter() - submitted) * 1000
+        with _executor_lock:
+            _executor_stats["calls"] += 1
+            _executor_stats["in_flight"] += 1
+            _executor_stats["max_in_flight"] = max(_executor_stats["max_in_flight"], _executor_stats["in_flight"])
+            _executor_stats["queue_ms"] += queued_ms
+            _executor_stats["max_queue_ms"] = max(_executor_stats["max_queue_ms"], queued_ms)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with _executor_lock:
+                _executor_stats["in_flight"] -= 1
+
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), call)
+
+
+def executor_stats() -> dict:
+    with _executor_lock:
+        stats = dict(_executor_stats)
+    calls = stats["calls"]
+    return {
+        "workers": DB_WORKERS,
+        "calls": calls,
+        "in_flight": stats["in_flight"],
+        "max_in_flight": stats["max_in_flight"],
+        "avg_queue_ms": round(stats["queue_ms"] / calls, 3) if calls else 0.0,
+        "max_queue_ms": round(stats["max_queue_ms"], 3),
+    }
+
+
+def shutdown_executor():
+    """Дождаться начатых вызовов run_db и остановить потоки (пул пересоздастся при следующем вызове)."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
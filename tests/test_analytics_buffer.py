@@ -0,0 +1,127 @@
+"""
+Буфер аналитики: одно битое событие не должно блокировать запись остальных.
+
+    python -m pytest tests
+"""
+import sqlite3
+
+import pytest
+
+import storage
+from analytics_buffer import ROLLUPS, AnalyticsBuffer, event_error, init_analytics_schema, init_rollups
+
+@pytest.fixture
+def db(tmp_path):
+    path = tmp_path / "analytics.db"
+    with sqlite3.connect(path) as conn:
+        init_analytics_schema(conn)
+    yield path
+    storage.close_all()
+
+
+def stored(path, sql: str):
+    with sqlite3.connect(path) as conn:
+        return conn.execute(sql).fetchall()
+
+
+def test_poisoned_values_are_normalized(db):
+    buffer = AnalyticsBuffer(db)
+    buffer.add(1, "open_screen", {"platform": "ios"}, "2025-01-01T12:00:00")
+    buffer.add(2, ["not", "a", "string"], {"platform": {"os": "ios"}}, {"ts": 1})
+    buffer.add(3, None, None, None)
+    buffer.add(1, "search", {"platform": "ios"}, "2025-01-01T12:00:01")
+
+    assert buffer.flush() == 4
+    assert stored(db, "SELECT user_id, action FROM analytics ORDER BY id") == [
+        ("1", "open_screen"), ("2", "unknown"), ("3", "unknown"), ("1", "search"),
+    ]
+    assert stored(db, "SELECT user_id, total_actions, platform FROM user_profiles ORDER BY user_id") == [
+        ("1", 2, "ios"), ("2", 1, "unknown"), ("3", 1, "unknown"),
+    ]
+    assert stored(db, "SELECT action, platform, count FROM analytics_rollup_day ORDER BY 1, 2") == [
+        ("open_screen", "ios", 1), ("search", "ios", 1), ("unknown", "unknown", 2),
+    ]
+
+
+def test_rejected_event_does_not_block_the_batch(db):
+    # Событие, которое БД отвергает при любой попытке (неисправимая ошибка сброса)
+    with sqlite3.connect(db) as conn:
+        conn.execute("""
+            CREATE TRIGGER reject_poison BEFORE INSERT ON analytics WHEN NEW.action = 'poison' BEGIN
+                SELECT RAISE(ABORT, 'poisoned event');
+            END
+        """)
+    buffer = AnalyticsBuffer(db)
+    for i in range(5):
+        buffer.add(100 + i, "poison" if i == 2 else "click_button", {"platform": "android"}, f"2025-01-01T12:00:0{i}")
+
+    assert buffer.flush() == 4
+    assert buffer.pending() == 0  # в буфер не вернулось — следующий сброс не упрётся в то же событие
+    assert stored(db, "SELECT user_id FROM analytics ORDER BY id") == [("100",), ("101",), ("103",), ("104",)]
+    # Отвергнутое событие не попадает ни в профили, ни в роллапы
+    assert stored(db, "SELECT user_id FROM user_profiles ORDER BY user_id") == [("100",), ("101",), ("103",), ("104",)]
+    assert stored(db, "SELECT action, count FROM analytics_rollup_day") == [("click_button", 4)]
+    stats = buffer.stats()
+    assert stats["written"] == 4 and stats["dropped"] == 1 and stats["failed_flushes"] == 0
+
+    buffer.add(105, "click_button", {"platform": "android"}, "2025-01-01T12:00:05")
+    assert buffer.flush() == 1
+
+
+def test_profile_lookup_error_does_not_fail_flush(db):
+    def broken_lookup(user_ids):
+        raise sqlite3.OperationalError("database is locked")
+
+    buffer = AnalyticsBuffer(db, profile_lookup=broken_lookup)
+    buffer.add(7, "open_screen", {"platform": "tdesktop"}, "2025-01-01T12:00:00")
+
+    assert buffer.flush() == 1
+    assert stored(db, "SELECT user_id, first_name, username FROM user_profiles") == [("7", "", "")]
+
+
+@pytest.mark.parametrize("event", [
+    [1, 2],
+    {"user_id": {"id": 1}, "action": "x"},
+    {"user_id": True, "action": "x"},
+    {"user_id": 1, "action": ["x"]},
+    {"user_id": 1, "action": "x", "details": "ios"},
+    {"user_id": 1, "action": "x", "details": {"platform": 5}},
+    {"user_id": 1, "action": "x", "timestamp": 1700000000},
+])
+def test_event_error_rejects_bad_events(event):
+    assert event_error(event)
+
+
+def test_event_error_accepts_client_events():
+    assert event_error({"user_id": 1, "action": "search", "details": {"query": "m4", "platform": "ios"},
+                        "timestamp": "2025-01-01T12:00:00.000Z"}) is None
+    assert event_error({"user_id": "42", "action": "session_end"}) is None
+
+
+def test_rollups_seeded_from_history_normalize_values(db):
+    with sqlite3.connect(db) as conn:
+        # База до появления роллапов: история есть, таблиц роллапов нет
+        for table, _ in ROLLUPS.values():
+            conn.execute(f"DROP TABLE {table}")
+        conn.executemany("INSERT INTO analytics (user_id, action, details, timestamp) VALUES (?, ?, ?, ?)", [
+            ("1", "search", '{"platform": "ios"}', "2025-01-01T12:00:00"),
+            ("1", None, '{"platform": {"os": "ios"}}', "2025-01-01T12:00:01"),
+            ("2", None, "not json", "2025-01-01T12:00:02"),
+        ])
+        init_rollups(conn)
+        assert conn.execute("SELECT action, platform, count FROM analytics_rollup_day ORDER BY 1").fetchall() == [
+            ("search", "ios", 1), ("unknown", "unknown", 2),
+        ]
+
+
+def test_requeue_keeps_counts_but_not_unwritable_rollup_keys(db):
+    buffer = AnalyticsBuffer(db)
+    buffer.add(1, "search", {"platform": "ios"}, "2025-01-01T12:00:00")
+    with buffer._lock:
+        buffer._rollup[("2025-01-01T12:00", None, "ios")] = 1
+        events, profiles, rollup = buffer._events, buffer._profiles, buffer._rollup
+        buffer._events, buffer._profiles, buffer._rollup = [], {}, {}
+    buffer._requeue(events, profiles, rollup)
+
+    assert buffer.flush() == 1
+    assert stored(db, "SELECT action, platform, count FROM analytics_rollup_day") == [("search", "ios", 1)]
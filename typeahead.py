@@ -0,0 +1,105 @@
+import re
+from itertools import chain
+
+# =====================================================
+# Индекс подсказок по модулям (ru + en).
+# Ключи — нормализованные полное название и каждый «хвост» с начала слова.
+# Для каждого префикса до SHORT_PREFIX символов заранее лежит отранжированный
+# список модулей; длинный запрос дофильтровывает список своего короткого префикса.
+# Ни SQL, ни сканирования таблицы на каждое нажатие клавиши.
+# =====================================================
+
+_WORD_RE = re.compile(r"[^\W_]+")
+
+# Порядок выдачи: точное совпадение, начало названия, начало слова внутри названия
+MATCH_EXACT, MATCH_PREFIX, MATCH_WORD = 0, 1, 2
+
+# Префиксы до этой длины хранятся готовыми отранжированными списками
+SHORT_PREFIX = 3
+
+
+def normalize(text: str) -> str:
+    """casefold + ё→е + схлопывание пробелов: «Ёмкий  МАГАЗИН» → «емкий магазин»."""
+    return " ".join(str(text or "").casefold().replace("ё", "е").split())
+
+
+class ModuleIndex:
+    """Неизменяемый индекс по снимку модулей {weapon_type: {category: [{id,en,ru,pos}]}}."""
+
+    __slots__ = ("revision", "modules", "_names", "_words", "_short", "_exact")
+
+    def __init__(self, revision, snapshot: dict):
+        self.revision = revision
+        self.modules: list[dict] = []
+        self._names: list[tuple[str, ...]] = []
+        self._words: list[tuple[str, ...]] = []
+        self._exact: dict[str, list[int]] = {}
+        short: dict[str, dict[int, int]] = {}
+
+        for weapon_type, categories in snapshot.items():
+            for category, items in categories.items():
+                for item in items:
+                    idx = len(self.modules)
+                    self.modules.append({
+                        "id": item["id"], "weapon_type": weapon_type, "category": category,
+                        "en": item["en"], "ru": item["ru"], "pos": item["pos"],
+                    })
+                    names = tuple(n for n in {normalize(item["en"]), normalize(item["ru"])} if n)
+                    words = tuple(name[m.start():] for name in names
+                                  for m in _WORD_RE.finditer(name) if m.start())
+                    self._names.append(names)
+                    self._words.append(words)
+                    for name in names:
+                        self._exact.setdefault(name, []).append(idx)
+                    for key, kind in chain(((n, MATCH_PREFIX) for n in names), ((w, MATCH_WORD) for w in words)):
+                        for n in range(1, min(len(key), SHORT_PREFIX) + 1):
+                            best = short.setdefault(key[:n], {})
+                            if kind < best.get(idx, MATCH_WORD + 1):
+                                best[idx] = kind
+
+        self._short = {
+            prefix: [idx for idx, _ in sorted(best.items(), key=lambda p: self._rank(*p))]
+            for prefix, best in short.items()
+        }
+
+    def _rank(self, idx: int, kind: int) -> tuple:
+        m = self.modules[idx]
+        return kind, m["category"], m["pos"], m["ru"]
+
+    def __len__(self):
+        return len(self.modules)
+
+    def search(self, query: str, weapon_type: str | None = None, limit: int = 20) -> list[dict]:
+        """
+        Модули, у которых название (или слово в нём) начинается с query.
+        Ранжирование: точное совпадение, начало названия, начало слова; внутри — категория, pos, ru.
+        """
+        q = normalize(query)
+        if not q:
+            return []
+        candidates = self._short.get(q[:SHORT_PREFIX], ())
+        picked: list[int] = []
+        seen: set[int] = set()
+
+        def take(indices) -> bool:
+            for idx in indices:
+                if idx in seen:
+                    continue
+                seen.add(idx)
+                if weapon_type is None or self.modules[idx]["weapon_type"] == weapon_type:
+                    picked.append(idx)
+                    if len(picked) >= limit:
+                        return True
+            return False
+
+        if len(q) <= SHORT_PREFIX:
+            # Список короткого префикса уже отранжирован — достаточно первых limit
+            take(chain(self._exact.get(q, ()), candidates))
+        elif not take(self._exact.get(q, ())) and not take(
+            idx for idx in candidates if any(n.startswith(q) for n in self._names[idx])
+        ):
+            # Совпадения только по слову внутри названия — их немного, сортируем отдельно
+            rest = [idx for idx in candidates
+                    if idx not in seen and any(w.startswith(q) for w in self._words[idx])]
+            take(sorted(rest, key=lambda idx: self._rank(idx, MATCH_WORD)))
+        return [self.modules[idx] for idx in picked]